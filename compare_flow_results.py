@@ -7,8 +7,18 @@
 
 import os
 import argparse
+import csv
+import hashlib
+import re
+import sqlite3
+import tempfile
+import time
 import xml.etree.ElementTree as ET
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
 """
     Recursively searches for all 'flow_results.xml' files within the specified main directory.
@@ -111,31 +121,519 @@ def extract_flow_data(file_path, flow_name):
     y_label (str): The label for the y-axis.
     output_path (str): The path to save the generated plot.
     is_flow (bool): Indicates whether the plot is for a specific flow. Default is False.
+    errors (dict): A dictionary mapping simulation labels to the (low, high) bounds of the confidence
+                   interval, drawn as error bars. Default is None for no error bars.
     """
 
 
-def plot_comparison(data, title, y_label, output_path, is_flow=False):
-    plt.figure(figsize=(10, 6))
-    for label, values in data.items():
-        plt.bar(label, values)
-
-    plt.xlabel('Simulation Run')
-    plt.ylabel(y_label)
-    plt.title(title)
-    plt.xticks(rotation=45, ha='right')
-    plt.tight_layout()
+def plot_comparison(data, title, y_label, output_path, is_flow=False, errors=None):
+    fig = _get_figure()
+    ax = fig.add_subplot()
+    labels = list(data.keys())
+    values = list(data.values())
+    yerr = None
+    if errors:
+        # clipped as rounding can put the bounds of a constant metric marginally beside the mean
+        yerr = [[max(0, value - errors[label][0]) for label, value in data.items()],
+                [max(0, errors[label][1] - value) for label, value in data.items()]]
+    # one color per bar as with one bar call per simulation run
+    ax.bar(labels, values, color=[f"C{i}" for i in range(len(labels))], yerr=yerr, capsize=4)
+
+    ax.set_xlabel('Simulation Run')
+    ax.set_ylabel(y_label)
+    ax.set_title(title)
+    ax.tick_params(axis='x', labelrotation=45)
+    for tick in ax.get_xticklabels():
+        tick.set_horizontalalignment('right')
+    fig.tight_layout()
 
     if is_flow:
         output_file = os.path.join(output_path, f"{title.replace(' ', '_')}_comparison_flow.png")
     else:
         output_file = os.path.join(output_path, f"{title.replace(' ', '_')}_comparison_summary.png")
 
-    plt.savefig(output_file)
-    plt.close()
+    fig.savefig(output_file)
+
+
+# every process draws all its plots on one reused Agg figure instead of creating one through pyplot per plot
+_figure = None
+
+
+def _get_figure():
+    global _figure
+    if _figure is None:
+        _figure = Figure(figsize=(10, 6))
+        FigureCanvasAgg(_figure)
+    _figure.clear()
+    return _figure
+
+
+def _render(plot):
+    plot_comparison(*plot)
+
+
+"""
+    Renders plots on a process pool.
+
+    Parameters:
+    plots (list): A list of argument tuples for plot_comparison.
+    jobs (int): The number of worker processes, None for one per CPU. Default is 1, which renders in the
+    current process.
+    """
+
+
+def render_plots(plots, jobs=1):
+    jobs = min(jobs or os.cpu_count() or 1, len(plots))
+    if jobs <= 1:
+        for plot in plots:
+            _render(plot)
+        return
+    with ProcessPoolExecutor(jobs) as executor:
+        for _ in executor.map(_render, plots, chunksize=max(1, len(plots) // (4 * jobs))):
+            pass
+
+
+TIME_SERIES_METRICS = {
+    'vehicles': "Vehicles",
+    'search_distance': "Search Distance (m)",
+    'search_time': "Search Time (s)",
+    'walking_distance': "Walking Distance (m)",
+    'not_arrived': "Not Arrived",
+}
+
+
+"""
+    Reads a time series written by parkingSearchTraffic.py --window-output and sums it per time window.
+
+    Parameters:
+    file_path (str): The path to the time series CSV file.
+    flow_name (str): The ID of the flow to extract data for. Default is None, which sums all flows.
+
+    Returns:
+    tuple: A tuple containing:
+        - parent_directory (str): The name of the parent directory containing the CSV file.
+        - data (dict): A dictionary mapping each window begin (float) to a dictionary with the summed
+          'vehicles', 'search_distance', 'search_time', 'walking_distance' and 'not_arrived' values.
+    """
+
+
+def extract_time_series(file_path, flow_name=None):
+    data = {}
+    with open(file_path, newline="") as f:
+        for row in csv.DictReader(f):
+            if flow_name and row['flow_id'] != flow_name:
+                continue
+            window = data.setdefault(float(row['begin']), dict.fromkeys(TIME_SERIES_METRICS, 0.))
+            for metric in TIME_SERIES_METRICS:
+                window[metric] += float(row[metric])
+    parent_directory = os.path.basename(os.path.dirname(os.path.dirname(file_path)))
+    return parent_directory, data
+
+
+"""
+    Generates one line plot per metric comparing the time series of different simulations and saves the plots.
+
+    Parameters:
+    series (dict): A dictionary where keys are simulation labels and values are the results of
+                   extract_time_series.
+    output_path (str): The path to save the generated plots.
+    flow_name (str): The flow the time series belong to. Default is None for all flows.
+    """
+
+
+def plot_time_series(series, output_path, flow_name=None):
+    suffix = f"for Flow {flow_name}" if flow_name else "Summary"
+    for metric, y_label in TIME_SERIES_METRICS.items():
+        fig = _get_figure()
+        ax = fig.add_subplot()
+        for label, data in series.items():
+            windows = sorted(data)
+            ax.step(windows, [data[w][metric] for w in windows], where='post', label=label)
+
+        ax.set_xlabel('Simulation Time (s)')
+        ax.set_ylabel(y_label)
+        title = f"{y_label.split(' (')[0]} per Time Window {suffix}"
+        ax.set_title(title)
+        ax.legend()
+        fig.tight_layout()
+        fig.savefig(os.path.join(output_path, f"{title.replace(' ', '_')}_time_series.png"))
+
+
+METRICS = ('total_vehicles', 'total_distance', 'total_time', 'total_walking_distance', 'not_arrived')
+XML_TAGS = ('TotalVehicles', 'TotalDistance', 'TotalTime', 'TotalWalkingDistance', 'NotArrived')
+DEFAULT_INDEX = ".flow_results.sqlite"
+
+"""
+    Extracts the summary and the data of all flows from a 'flow_results.xml' file in one pass.
+
+    Parameters:
+    file_path (str): The path to the 'flow_results.xml' file.
+
+    Returns:
+    tuple: A tuple containing:
+        - parent_directory (str): The name of the parent directory containing the XML file.
+        - summary (dict): The summary statistics as returned by extract_summary_data.
+        - flows (dict): A dictionary mapping each flow ID to its statistics as returned by extract_flow_data.
+    """
+
+
+def extract_all_data(file_path):
+    root = ET.parse(file_path).getroot()
+
+    def read(element):
+        return {metric: (int if metric in ('total_vehicles', 'not_arrived') else float)(element.find(tag).text)
+                for metric, tag in zip(METRICS, XML_TAGS)}
+
+    summary = read(root.find('Summary'))
+    flows = {flow.get('id'): read(flow) for flow in root.findall('Flow')}
+    parent_directory = os.path.basename(os.path.dirname(os.path.dirname(file_path)))
+    return parent_directory, summary, flows
+
+
+"""
+    Opens the result index and brings it up to date with the 'flow_results.xml' files below main_directory.
+
+    Every file is parsed only when it is new or its content changed. Files whose size and modification time
+    are unchanged are skipped without reading them, otherwise the SHA-256 of the content decides whether the
+    file has to be parsed again. Entries of files which no longer exist are removed.
+
+    Parameters:
+    main_directory (str): The main directory to start searching from.
+    index_file (str): The path of the SQLite index. Default is '.flow_results.sqlite' in main_directory.
+
+    Returns:
+    sqlite3.Connection: The connection to the refreshed index.
+    """
+
+
+def open_result_index(main_directory, index_file=None):
+    conn = sqlite3.connect(index_file or os.path.join(main_directory, DEFAULT_INDEX))
+    columns = ", ".join(f"{metric} REAL" for metric in METRICS)
+    conn.execute("CREATE TABLE IF NOT EXISTS files "
+                 "(path TEXT PRIMARY KEY, label TEXT, mtime REAL, size INTEGER, sha256 TEXT)")
+    conn.execute(f"CREATE TABLE IF NOT EXISTS results (path TEXT, flow_id TEXT, {columns})")
+    conn.execute("CREATE INDEX IF NOT EXISTS results_flow ON results (flow_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS results_path ON results (path)")
+
+    known = {path: (mtime, size, sha256) for path, mtime, size, sha256 in
+             conn.execute("SELECT path, mtime, size, sha256 FROM files")}
+    found = set()
+    with conn:
+        for file in find_flow_result_files(main_directory):
+            path = os.path.abspath(file)
+            found.add(path)
+            stat = os.stat(path)
+            if path in known and known[path][:2] == (stat.st_mtime, stat.st_size):
+                continue
+            with open(path, 'rb') as f:
+                sha256 = hashlib.sha256(f.read()).hexdigest()
+            if path not in known or known[path][2] != sha256:
+                label, summary, flows = extract_all_data(path)
+                conn.execute("DELETE FROM results WHERE path = ?", (path,))
+                # the summary is stored with flow_id NULL
+                conn.executemany(f"INSERT INTO results VALUES (?, ?, {', '.join('?' * len(METRICS))})",
+                                 [(path, flow_id) + tuple(data[m] for m in METRICS)
+                                  for flow_id, data in [(None, summary)] + list(flows.items())])
+            else:
+                label = conn.execute("SELECT label FROM files WHERE path = ?", (path,)).fetchone()[0]
+            conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                         (path, label, stat.st_mtime, stat.st_size, sha256))
+        for path in set(known) - found:
+            conn.execute("DELETE FROM results WHERE path = ?", (path,))
+            conn.execute("DELETE FROM files WHERE path = ?", (path,))
+    return conn
+
+
+"""
+    Queries the result index for the summary, one flow or all flows.
+
+    Parameters:
+    conn (sqlite3.Connection): The connection returned by open_result_index.
+    flow_name (str): The ID of the flow to query. Default is None for the summary.
+
+    Returns:
+    dict: A dictionary mapping each simulation label to its statistics (see extract_summary_data).
+    """
+
 
+def query_results(conn, flow_name=None):
+    condition = "r.flow_id IS NULL" if flow_name is None else "r.flow_id = ?"
+    rows = conn.execute(f"SELECT f.label, {', '.join('r.' + m for m in METRICS)} FROM results r "
+                        f"JOIN files f ON f.path = r.path WHERE {condition} ORDER BY f.path",
+                        () if flow_name is None else (flow_name,))
+    return {row[0]: _row_to_data(row[1:]) for row in rows}
+
+
+"""
+    Queries the result index for all flows at once.
+
+    Parameters:
+    conn (sqlite3.Connection): The connection returned by open_result_index.
+
+    Returns:
+    dict: A dictionary mapping each flow ID to a dictionary as returned by query_results for that flow.
+    """
+
+
+def query_all_flows(conn):
+    data = {}
+    for row in conn.execute(f"SELECT r.flow_id, f.label, {', '.join('r.' + m for m in METRICS)} FROM results r "
+                            "JOIN files f ON f.path = r.path WHERE r.flow_id IS NOT NULL ORDER BY r.flow_id, f.path"):
+        data.setdefault(row[0], {})[row[1]] = _row_to_data(row[2:])
+    return data
+
+
+def _row_to_data(values):
+    return {metric: int(v) if metric in ('total_vehicles', 'not_arrived') else v for metric, v in zip(METRICS, values)}
+
+
+PLOT_LABELS = {
+    'total_vehicles': ("Total Vehicles", "Total Vehicles"),
+    'total_distance': ("Total Distance", "Total Distance (m)"),
+    'total_time': ("Total Time", "Total Time (s)"),
+    'total_walking_distance': ("Total Walking Distance", "Total Walking Distance (m)"),
+    'not_arrived': ("Vehicles Not Arrived", "Not Arrived"),
+}
+
+
+def flow_comparison_plots(flow_data, flow_name, output_path, errors=None):
+    return [({k: v[metric] for k, v in flow_data.items()}, f"{title} for Flow {flow_name}", y_label, output_path,
+             True, errors and {k: v[metric] for k, v in errors.items()})
+            for metric, (title, y_label) in PLOT_LABELS.items()]
+
+
+def summary_comparison_plots(summary_data, output_path, errors=None):
+    return [({k: v[metric] for k, v in summary_data.items()}, f"{title} Summary", y_label, output_path,
+             False, errors and {k: v[metric] for k, v in errors.items()})
+            for metric, (title, y_label) in PLOT_LABELS.items()]
+
+
+# replicated runs of a scenario are either <scenario>/seed<N>/output/flow_results.xml
+# or <scenario>_seed<N>/output/flow_results.xml
+SEED_DIRECTORY = re.compile(r"^seed[_-]?\d+$")
+SEED_SUFFIX = re.compile(r"^(.+?)[_-]seed[_-]?\d+$")
+
+
+def scenario_name(file_path):
+    run_directory = os.path.dirname(os.path.dirname(os.path.abspath(file_path)))
+    name = os.path.basename(run_directory)
+    if SEED_DIRECTORY.match(name):
+        return os.path.basename(os.path.dirname(run_directory))
+    match = SEED_SUFFIX.match(name)
+    return match.group(1) if match else name
+
+
+"""
+    Groups result rows by scenario into one array per scenario.
+
+    Parameters:
+    rows (iterable): Tuples (path, flow_id, *metric values) with flow_id None for the summary, as stored in the
+                     result index.
+
+    Returns:
+    tuple: A tuple containing:
+        - flow_ids (list): None for the summary followed by the sorted IDs of all flows.
+        - replicates (dict): A dictionary mapping each scenario to an array of shape
+          (replicates, len(flow_ids), len(METRICS)). A flow missing from a run counts as zero for that run.
+    """
+
+
+def collect_replicates(rows):
+    runs = {}
+    for path, flow_id, *values in rows:
+        runs.setdefault(scenario_name(path), {}).setdefault(path, {})[flow_id] = values
+    flow_ids = sorted({flow_id for paths in runs.values() for flows in paths.values() for flow_id in flows
+                       if flow_id is not None})
+    flow_ids.insert(0, None)
+    column = {flow_id: i for i, flow_id in enumerate(flow_ids)}
+    replicates = {}
+    for scenario, paths in sorted(runs.items()):
+        values = np.zeros((len(paths), len(flow_ids), len(METRICS)))
+        for i, path in enumerate(sorted(paths)):
+            for flow_id, flow_values in paths[path].items():
+                values[i, column[flow_id]] = flow_values
+        replicates[scenario] = values
+    return flow_ids, replicates
+
+
+"""
+    Computes the mean over the replicates and its percentile bootstrap confidence interval for every flow and
+    metric at once.
+
+    Parameters:
+    values (numpy.ndarray): An array of shape (replicates, ...) as returned by collect_replicates.
+    samples (int): The number of bootstrap samples. Default is 1000.
+    confidence (float): The confidence level of the interval. Default is 0.95.
+    seed (int): The seed of the random generator. Default is None.
+
+    Returns:
+    tuple: The mean, the lower and the upper bound, each of shape values.shape[1:].
+    """
+
+
+def bootstrap_ci(values, samples=1000, confidence=0.95, seed=None):
+    count = len(values)
+    flat = values.reshape(count, -1)
+    # every bootstrap sample is a row of draw counts per replicate, so all resampled means are one matrix product
+    draws = np.random.default_rng(seed).multinomial(count, np.full(count, 1. / count), size=samples)
+    means = draws @ flat / count
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha], axis=0)
+    shape = values.shape[1:]
+    return flat.mean(axis=0).reshape(shape), low.reshape(shape), high.reshape(shape)
+
+
+"""
+    Writes the replicate means and confidence intervals of all scenarios, flows and metrics to a CSV file.
+
+    Parameters:
+    flow_ids (list): The flow IDs as returned by collect_replicates.
+    statistics (dict): A dictionary mapping each scenario to its replicate count and the result of bootstrap_ci.
+    output_file (str): The path of the CSV file.
+    """
+
+
+def write_replicate_csv(flow_ids, statistics, output_file):
+    with open(output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["scenario", "flow_id", "replicates", "metric", "mean", "ci_low", "ci_high"])
+        for scenario, (count, (mean, low, high)) in statistics.items():
+            for i, flow_id in enumerate(flow_ids):
+                for j, metric in enumerate(METRICS):
+                    writer.writerow([scenario, flow_id or "", count, metric, mean[i, j], low[i, j], high[i, j]])
+
+
+def _replicate_data(statistics, column):
+    data = {}
+    errors = {}
+    for scenario, (_, (mean, low, high)) in statistics.items():
+        data[scenario] = dict(zip(METRICS, mean[column].tolist()))
+        errors[scenario] = dict(zip(METRICS, zip(low[column].tolist(), high[column].tolist())))
+    return data, errors
+
+
+"""
+    Aggregates replicated runs of the same scenario and builds the comparison plots of the replicate means with
+    bootstrap confidence intervals as error bars.
+
+    Parameters:
+    rows (iterable): The result rows as accepted by collect_replicates.
+    output_path (str): The path to save the plots and 'replicate_ci.csv' to.
+    flow_name (str): The ID of the flow to plot. Default is None for the summary.
+    all_flows (bool): Plot every flow instead. Default is False.
+    samples (int): The number of bootstrap samples. Default is 1000.
+    confidence (float): The confidence level of the intervals. Default is 0.95.
+    seed (int): The seed of the random generator. Default is None.
+
+    Returns:
+    list: The plots to render with render_plots.
+    """
+
+
+def replicate_comparison_plots(rows, output_path, flow_name=None, all_flows=False, samples=1000, confidence=0.95,
+                               seed=None):
+    flow_ids, replicates = collect_replicates(rows)
+    statistics = {scenario: (len(values), bootstrap_ci(values, samples, confidence, seed))
+                  for scenario, values in replicates.items()}
+    write_replicate_csv(flow_ids, statistics, os.path.join(output_path, "replicate_ci.csv"))
+    if all_flows:
+        plots = []
+        for column, flow_id in enumerate(flow_ids[1:], 1):
+            data, errors = _replicate_data(statistics, column)
+            plots += flow_comparison_plots(data, flow_id, output_path, errors)
+        return plots
+    if flow_name:
+        if flow_name not in flow_ids:
+            return []
+        data, errors = _replicate_data(statistics, flow_ids.index(flow_name))
+        return flow_comparison_plots(data, flow_name, output_path, errors)
+    data, errors = _replicate_data(statistics, 0)
+    return summary_comparison_plots(data, output_path, errors)
+
+
+"""
+    Measures the time to regenerate all summary and per-flow plots serially and on a process pool.
+
+    Parameters:
+    main_directory (str): The main directory containing the simulation results.
+    jobs (int): The number of worker processes for the parallel run.
+    """
+
+
+def benchmark(main_directory, jobs=None):
+    conn = open_result_index(main_directory)
+    try:
+        summary_data = query_results(conn)
+        all_flow_data = query_all_flows(conn)
+    finally:
+        conn.close()
+    for label, plot_jobs in (("serial", 1), (f"{jobs or os.cpu_count()} processes", jobs)):
+        output_path = tempfile.mkdtemp()
+        plots = summary_comparison_plots(summary_data, output_path)
+        for flow_id, flow_data in all_flow_data.items():
+            plots += flow_comparison_plots(flow_data, flow_id, output_path)
+        start = time.perf_counter()
+        render_plots(plots, plot_jobs)
+        print(f"{label}: {len(plots)} plots in {time.perf_counter() - start:.2f} s (written to {output_path})")
+
+
+def main(main_directory, flow_name=None, time_series=None, all_flows=False, use_index=True, index_file=None,
+         jobs=None, replicates=False, samples=1000, confidence=0.95, seed=None):
+    output_path = os.path.join(main_directory, "..")
+    if replicates:
+        if use_index:
+            conn = open_result_index(main_directory, index_file)
+            try:
+                rows = conn.execute(f"SELECT path, flow_id, {', '.join(METRICS)} FROM results").fetchall()
+            finally:
+                conn.close()
+        else:
+            rows = []
+            for file in find_flow_result_files(main_directory):
+                _, summary, flows = extract_all_data(file)
+                rows += [(file, flow_id) + tuple(data[m] for m in METRICS)
+                         for flow_id, data in [(None, summary)] + list(flows.items())]
+        render_plots(replicate_comparison_plots(rows, output_path, flow_name, all_flows, samples, confidence, seed),
+                     jobs)
+        return
+
+    if time_series:
+        series = {}
+        for root, _, files in os.walk(main_directory):
+            if time_series in files:
+                label, data = extract_time_series(os.path.join(root, time_series), flow_name)
+                series[label] = data
+        plot_time_series(series, output_path, flow_name)
+        return
+
+    if use_index:
+        conn = open_result_index(main_directory, index_file)
+        try:
+            if all_flows:
+                plots = []
+                for flow_id, flow_data in query_all_flows(conn).items():
+                    plots += flow_comparison_plots(flow_data, flow_id, output_path)
+            elif flow_name:
+                plots = flow_comparison_plots(query_results(conn, flow_name), flow_name, output_path)
+            else:
+                plots = summary_comparison_plots(query_results(conn), output_path)
+        finally:
+            conn.close()
+        render_plots(plots, jobs)
+        return
 
-def main(main_directory, flow_name=None):
     flow_result_files = find_flow_result_files(main_directory)
+    if all_flows:
+        all_flow_data = {}
+        for file in flow_result_files:
+            label, _, flows = extract_all_data(file)
+            for flow_id, data in flows.items():
+                all_flow_data.setdefault(flow_id, {})[label] = data
+        plots = []
+        for flow_id, flow_data in all_flow_data.items():
+            plots += flow_comparison_plots(flow_data, flow_id, output_path)
+        render_plots(plots, jobs)
+        return
 
     summary_data = {}
     flow_data = {}
@@ -149,37 +647,37 @@ def main(main_directory, flow_name=None):
             label, data = extract_summary_data(file)
             summary_data[label] = data
 
-    output_path = os.path.join(main_directory, "..")
-
     if flow_name:
-        plot_comparison({k: v['total_vehicles'] for k, v in flow_data.items()}, f"Total Vehicles for Flow {flow_name}",
-                        "Total Vehicles", output_path, is_flow=True)
-        plot_comparison({k: v['total_distance'] for k, v in flow_data.items()}, f"Total Distance for Flow {flow_name}",
-                        "Total Distance (m)", output_path, is_flow=True)
-        plot_comparison({k: v['total_time'] for k, v in flow_data.items()}, f"Total Time for Flow {flow_name}",
-                        "Total Time (s)", output_path, is_flow=True)
-        plot_comparison({k: v['total_walking_distance'] for k, v in flow_data.items()},
-                        f"Total Walking Distance for Flow {flow_name}", "Total Walking Distance (m)", output_path,
-                        is_flow=True)
-        plot_comparison({k: v['not_arrived'] for k, v in flow_data.items()},
-                        f"Vehicles Not Arrived for Flow {flow_name}", "Not Arrived", output_path, is_flow=True)
+        render_plots(flow_comparison_plots(flow_data, flow_name, output_path), jobs)
     else:
-        plot_comparison({k: v['total_vehicles'] for k, v in summary_data.items()}, "Total Vehicles Summary",
-                        "Total Vehicles", output_path)
-        plot_comparison({k: v['total_distance'] for k, v in summary_data.items()}, "Total Distance Summary",
-                        "Total Distance (m)", output_path)
-        plot_comparison({k: v['total_time'] for k, v in summary_data.items()}, "Total Time Summary", "Total Time (s)",
-                        output_path)
-        plot_comparison({k: v['total_walking_distance'] for k, v in summary_data.items()},
-                        "Total Walking Distance Summary", "Total Walking Distance (m)", output_path)
-        plot_comparison({k: v['not_arrived'] for k, v in summary_data.items()}, "Vehicles Not Arrived Summary",
-                        "Not Arrived", output_path)
+        render_plots(summary_comparison_plots(summary_data, output_path), jobs)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Compare flow results from multiple simulations.")
     parser.add_argument("main_directory", help="Main directory containing the simulation results.")
     parser.add_argument("--flow_name", help="Specific flow name to compare", required=False)
+    parser.add_argument("--time_series", nargs="?", const="flow_windows.csv",
+                        help="Plot the time series files with this name (default flow_windows.csv) written by "
+                             "parkingSearchTraffic.py --window-output instead of the totals")
+    parser.add_argument("--all_flows", action="store_true", help="Plot the comparison of every flow")
+    parser.add_argument("--index", help="Path of the result index (default .flow_results.sqlite in main_directory)")
+    parser.add_argument("--no_index", action="store_true", help="Parse the XML files instead of using the index")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Number of processes rendering the plots (default: number of CPUs)")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Time regenerating all summary and flow plots serially and in parallel")
+    parser.add_argument("--replicates", action="store_true",
+                        help="Aggregate replicated runs of a scenario (<scenario>/seed<N>/ or <scenario>_seed<N>/) "
+                             "and plot their means with bootstrap confidence intervals")
+    parser.add_argument("--bootstrap", type=int, default=1000, help="Number of bootstrap samples (default 1000)")
+    parser.add_argument("--confidence", type=float, default=0.95,
+                        help="Confidence level of the bootstrap intervals (default 0.95)")
+    parser.add_argument("--seed", type=int, help="Seed for the bootstrap resampling")
     args = parser.parse_args()
 
-    main(args.main_directory, args.flow_name)
+    if args.benchmark:
+        benchmark(args.main_directory, args.jobs)
+    else:
+        main(args.main_directory, args.flow_name, args.time_series, args.all_flows, not args.no_index, args.index,
+             args.jobs, args.replicates, args.bootstrap, args.confidence, args.seed)
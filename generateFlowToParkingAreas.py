@@ -1,18 +1,36 @@
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
 import argparse
+import contextlib
+import heapq
+import math
 import random
 
+import numpy as np
+
+ROUTES_HEADER = '''<?xml version='1.0' encoding='UTF-8'?>
+<routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+        xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">
+'''
+FLOW_TEMPLATE = '''    <flow id=%s type="car" begin="2" period="2" number="%s" from=%s>
+        <stop parkingArea=%s duration="3600"/>
+    </flow>
+'''
+
+
+# Function to stream the parking area data from a ParkingAreas XML, every element is dropped once it is read
+def iter_parking_areas(file_path):
+    context = ET.iterparse(file_path, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag == 'parkingArea':
+            yield elem.get('id'), int(elem.get('roadsideCapacity')), elem.get('lane')
+            root.clear()
+
 
 # Function to parse ParkingAreas XML and extract parking area data
 def parse_parking_areas(file_path):
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-    parking_areas = []
-    for parking_area in root.findall('parkingArea'):
-        id = parking_area.get('id')
-        capacity = int(parking_area.get('roadsideCapacity'))
-        parking_areas.append((id, capacity))
-    return parking_areas
+    return list(iter_parking_areas(file_path))
 
 
 # Function to read edges from a file
@@ -23,49 +41,162 @@ def read_edges(file_path):
     return edge_list
 
 
-# Function to create a new Routes XML with flows based on parking areas and edge IDs
-def create_routes_xml(parking_areas, edge_list, flow_factor, output_file):
-    routes = ET.Element('routes', {
-        'xmlns:xsi': "http://www.w3.org/2001/XMLSchema-instance",
-        'xsi:noNamespaceSchemaLocation': "http://sumo.dlr.de/xsd/routes_file.xsd"
-    })
-
-    for id, capacity in parking_areas:
-        from_edge = random.choice(edge_list)
-        flow = ET.SubElement(routes, 'flow', {
-            'id': f'flow_{id}',
-            'type': 'car',
-            'begin': '2',
-            'period': '2',
-            'number': str(flow_factor * capacity),
-            'from': from_edge
-        })
-        stop = ET.SubElement(flow, 'stop', {
-            'parkingArea': id,
-            'duration': '3600'
-        })
-
-    tree = ET.ElementTree(routes)
-    tree.write(output_file, encoding='UTF-8', xml_declaration=True)
+# Function to parse distance bands like "0-500,500-2000" into (min, max) tuples in meters
+def parse_distance_bands(bands):
+    return [tuple(float(value) for value in band.split('-')) for band in bands.split(',')]
+
+
+# Picks the origin of every flow uniformly from the edge list without looking at the network
+class RandomOrigins:
+    def __init__(self, edge_list, seed=None):
+        self.edge_list = edge_list
+        self.rng = random.Random(seed)
+
+    def choose(self, parking_lane):
+        return self.rng.choice(self.edge_list)
+
+
+# Picks the origin of every flow among the candidate edges from which passenger cars can drive to the parking area.
+# The driving distance is measured from the start of the origin edge to the start of the parking area edge.
+# It comes from a reverse Dijkstra from the parking area edge, which is run once per edge and stops as soon as all
+# candidates are settled. With distance bands the search is bounded by the largest band. The straight line between
+# the edge starts is no bound of the driving distance (it leaves out the internal lanes of the junctions), so the
+# search is not limited to the candidates within that range. Without bands only reachability matters and the
+# distance is not kept.
+class ReachableOrigins:
+    def __init__(self, net, edge_list=None, bands=None, seed=None):
+        self.net = net
+        self.rng = random.Random(seed)
+        self.bands = bands
+        self.limit = max(band[1] for band in bands) if bands else math.inf
+        self.lengths = net.lengths.tolist()
+        self.passenger = net.passenger.tolist()
+        if edge_list:
+            unknown = [edge for edge in edge_list if edge not in net.index]
+            if unknown:
+                print("Warning! Ignoring origin edges missing in the network: %s" % ", ".join(unknown))
+            self.candidates = np.array(sorted({net.index[edge] for edge in edge_list if edge in net.index}),
+                                       dtype=np.int64)
+        else:
+            self.candidates = np.flatnonzero(net.passenger)
+        in_offsets, in_edges = net.in_offsets.tolist(), net.in_edges.tolist()
+        self.predecessors = [in_edges[in_offsets[e]:in_offsets[e + 1]] for e in range(len(self.lengths))]
+        self.candidate_set = set(self.candidates.tolist())
+        self.distances = {}
+
+    # Dijkstra from source over the predecessors, where entering an edge costs its own length as it is driven
+    # before the edge it leads to
+    def _search(self, source, wanted):
+        lengths, passenger, limit, predecessors = self.lengths, self.passenger, self.limit, self.predecessors
+        heappop, heappush = heapq.heappop, heapq.heappush
+        remaining = len(wanted)
+        best = {source: 0.}
+        settled = {}
+        heap = [(0., source)]
+        while heap and remaining:
+            dist, edge = heappop(heap)
+            if edge in settled:
+                continue
+            settled[edge] = dist
+            if edge in wanted:
+                remaining -= 1
+            for next_edge in predecessors[edge]:
+                next_dist = dist + lengths[next_edge]
+                if next_dist <= limit and passenger[next_edge] and next_dist < best.get(next_edge, limit + 1):
+                    best[next_edge] = next_dist
+                    heappush(heap, (next_dist, next_edge))
+        return settled
+
+    # Returns the reachable candidates of the target edge with their driving distance (None without bands)
+    def driving_distances(self, target):
+        if target in self.distances:
+            return self.distances[target]
+        settled = self._search(target, self.candidate_set)
+        result = sorted((edge, dist if self.bands else None) for edge, dist in settled.items()
+                        if edge in self.candidate_set)
+        self.distances[target] = result
+        return result
+
+    def choose(self, parking_lane):
+        target = self.net.index.get(parking_lane.rsplit('_', 1)[0])
+        if target is None:
+            return None
+        reachable = self.driving_distances(target)
+        if not self.bands:
+            return str(self.net.edge_ids[self.rng.choice(reachable)[0]]) if reachable else None
+        first = self.rng.randrange(len(self.bands))
+        # the drawn band first, then the other bands in their given order
+        for low, high in [self.bands[first]] + self.bands[:first] + self.bands[first + 1:]:
+            in_band = [edge for edge, dist in reachable if low <= dist <= high]
+            if in_band:
+                return str(self.net.edge_ids[self.rng.choice(in_band)])
+        return None
+
+
+# Function to write one Routes XML per flow factor with flows based on parking areas and edge IDs.
+# The files are written incrementally while the parking areas are read, each flow gets the same origin in all
+# files and the origins only depend on the seed and the order of the parking areas. Parking areas without a
+# possible origin are skipped.
+def create_routes_xml(parking_areas, origins, flow_factors, output_files):
+    with contextlib.ExitStack() as stack:
+        outputs = [stack.enter_context(open(output_file, 'w', encoding='UTF-8')) for output_file in output_files]
+        for output in outputs:
+            output.write(ROUTES_HEADER)
+        for id, capacity, lane in parking_areas:
+            from_edge = origins.choose(lane)
+            if from_edge is None:
+                print("Warning! No origin can reach parking area '%s', skipping its flow." % id)
+                continue
+            for output, flow_factor in zip(outputs, flow_factors):
+                output.write(FLOW_TEMPLATE % (quoteattr(f'flow_{id}'), flow_factor * capacity, quoteattr(from_edge),
+                                              quoteattr(id)))
+        for output in outputs:
+            output.write('</routes>\n')
 
 
 def main():
     parser = argparse.ArgumentParser(description='Generate Routes XML from ParkingAreas XML')
     parser.add_argument('-pa', '--parkingAreas', type=str, required=True, help='Path to the ParkingAreas XML file')
-    parser.add_argument('-o', '--output', type=str, required=True, help='Path to the output Routes XML file')
-    parser.add_argument('-fe', '--flowEdges', type=str, required=True,
-                        help='Path to the file containing comma-separated edge IDs')
-    parser.add_argument('-ff', '--flow-factor', type=int, default=2,
-                        help='Factor to multiply with capacity for flow number')
+    parser.add_argument('-o', '--output', type=str, required=True,
+                        help='Path to the output Routes XML file, with several flow factors it must contain '
+                             '{factor} (e.g. flow_{factor}.rou.xml)')
+    parser.add_argument('-fe', '--flowEdges', type=str,
+                        help='Path to the file containing comma-separated edge IDs, required without --net. '
+                             'With --net all edges allowing passenger cars are candidates by default')
+    parser.add_argument('-ff', '--flow-factor', type=str, default='2',
+                        help='Comma-separated factors to multiply with capacity for flow number, '
+                             'one Routes XML is written per factor')
+    parser.add_argument('-s', '--seed', type=int, default=42, help='Seed for the choice of the origin edges')
+    parser.add_argument('-n', '--net', type=str,
+                        help='Path to the network, only origins from which the parking area can be reached are used')
+    parser.add_argument('-db', '--distance-bands', type=str,
+                        help='Comma-separated driving distance bands in meters (e.g. 0-500,500-2000), every flow '
+                             'gets an origin from a randomly drawn band (requires --net)')
+    parser.add_argument('--net-cache', type=str,
+                        help='Directory of the binary net cache (default: .netcache next to the net)')
 
     args = parser.parse_args()
+    flow_factors = [int(factor) for factor in args.flow_factor.split(',')]
+    if len(flow_factors) > 1 and '{factor}' not in args.output:
+        parser.error('the output path must contain {factor} when several flow factors are given')
+    if args.net is None and (args.flowEdges is None or args.distance_bands):
+        parser.error('--flowEdges is required and --distance-bands is not possible without --net')
+    if args.flowEdges is None and args.distance_bands is None:
+        parser.error('--distance-bands is required when all edges are origin candidates')
 
-    # Parse parking areas and edge list
-    parking_areas = parse_parking_areas(args.parkingAreas)
-    edge_list = read_edges(args.flowEdges)
+    # Stream parking areas and read the edge list
+    parking_areas = iter_parking_areas(args.parkingAreas)
+    edge_list = read_edges(args.flowEdges) if args.flowEdges else None
+    if args.net:
+        from netcache import load_snapshot
+        bands = parse_distance_bands(args.distance_bands) if args.distance_bands else None
+        origins = ReachableOrigins(load_snapshot(args.net, args.net_cache), edge_list, bands, args.seed)
+    else:
+        origins = RandomOrigins(edge_list, args.seed)
 
-    # Generate routes XML
-    create_routes_xml(parking_areas, edge_list, args.flow_factor, args.output)
+    # Generate one routes XML per flow factor in a single pass
+    create_routes_xml(parking_areas, origins, flow_factors,
+                      [args.output.replace('{factor}', str(factor)) for factor in flow_factors])
 
 
 if __name__ == '__main__':
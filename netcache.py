@@ -0,0 +1,205 @@
+# Compact binary snapshot of the edge graph of a SUMO network, cached on disk so that tools which only need
+# edge lengths, the topology and the geometry do not have to parse the network XML on every run.
+#
+# Cache layout and invalidation:
+#   <cache dir>/<sha256 of the net file>-v<FORMAT_VERSION>/  one .npy file per array plus meta.json
+# - The key is the content hash of the net file, so any change to the network (even with an unchanged
+#   modification time) leads to a new entry; entries of older network versions are never read again.
+# - Bumping FORMAT_VERSION invalidates all existing entries.
+# - Entries are written to a temporary directory that is renamed when complete, an entry which cannot be
+#   loaded (missing arrays, different format) is rebuilt from the XML.
+# - Nothing is deleted automatically, remove the cache directory to reclaim the space.
+# The arrays are loaded memory-mapped, so several processes evaluating the same network share one copy.
+# @file    netcache.py
+# @author  Mohamed Abdulmaksoud
+# @date    2026-10-17
+
+import hashlib
+import heapq
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.join(os.environ["SUMO_HOME"], 'tools'))
+import sumolib  # noqa
+
+FORMAT_VERSION = 2
+DEFAULT_CACHE_DIR = ".netcache"
+ARRAYS = ("edge_ids", "lengths", "speeds", "passenger", "from_nodes", "to_nodes", "node_ids", "node_coords",
+          "out_offsets", "out_edges", "in_offsets", "in_edges", "node_in_offsets", "node_in_edges",
+          "shape_offsets", "shape_coords")
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Returns the SHA-256 hex digest of the content of the given file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _csr(lists, dtype=np.int64):
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(values) for values in lists], out=offsets[1:])
+    values = [v for values in lists for v in values]
+    return offsets, np.array(values, dtype=dtype).reshape((-1,) + np.shape(values)[1:])
+
+
+class NetSnapshot:
+    """
+    The normal (non-internal) edges of a network with their lengths, speeds, passenger car permission, end nodes,
+    connections and shapes.
+
+    Edges are indexed in the order of their sorted IDs, so comparing two edge indices gives the same result as
+    comparing the sumolib edges (sumolib.net.edge.Edge.__lt__) and searches on the snapshot break ties like
+    the sumolib routing does. All per-edge lists are stored as CSR pairs: the values of edge i are
+    values[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, arrays, has_walking_area=False):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.has_walking_area = has_walking_area
+        self.index = {edge_id: i for i, edge_id in enumerate(self.edge_ids.tolist())}
+        self._successors = None
+
+    @classmethod
+    def from_net(cls, net):
+        edges = sorted(net.getEdges(withInternal=False), key=lambda e: e.getID())
+        index = {e: i for i, e in enumerate(edges)}
+        nodes = net.getNodes()
+        node_index = {n: i for i, n in enumerate(nodes)}
+        arrays = {
+            "edge_ids": np.array([e.getID() for e in edges], dtype=np.str_),
+            "lengths": np.array([e.getLength() for e in edges], dtype=np.float64),
+            "speeds": np.array([e.getSpeed() for e in edges], dtype=np.float64),
+            "passenger": np.array([e.allows("passenger") for e in edges], dtype=bool),
+            "from_nodes": np.array([node_index[e.getFromNode()] for e in edges], dtype=np.int64),
+            "to_nodes": np.array([node_index[e.getToNode()] for e in edges], dtype=np.int64),
+            "node_ids": np.array([n.getID() for n in nodes], dtype=np.str_),
+            "node_coords": np.array([n.getCoord()[:2] for n in nodes], dtype=np.float64).reshape(-1, 2),
+        }
+        # the connection order of sumolib is kept, it decides between equally long paths
+        arrays["out_offsets"], arrays["out_edges"] = _csr(
+            [[index[o] for o in e.getOutgoing() if o in index] for e in edges])
+        arrays["in_offsets"], arrays["in_edges"] = _csr(
+            [[index[i] for i in e.getIncoming() if i in index] for e in edges])
+        arrays["node_in_offsets"], arrays["node_in_edges"] = _csr(
+            [[index[i] for i in n.getIncoming() if i in index] for n in nodes])
+        arrays["shape_offsets"], arrays["shape_coords"] = _csr(
+            [[xy[:2] for xy in e.getShape()] for e in edges], np.float64)
+        arrays["shape_coords"] = arrays["shape_coords"].reshape(-1, 2)
+        return cls(arrays, net.hasWalkingArea)
+
+    def save(self, directory, net_hash):
+        """Writes the snapshot atomically to directory, an existing complete entry is left untouched."""
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+        try:
+            for name in ARRAYS:
+                np.save(os.path.join(staging, name + ".npy"), getattr(self, name), allow_pickle=False)
+            with open(os.path.join(staging, "meta.json"), "w") as f:
+                json.dump({"version": FORMAT_VERSION, "net_sha256": net_hash,
+                           "has_walking_area": self.has_walking_area}, f)
+            os.rename(staging, directory)
+        except OSError:
+            # another process finished the same entry first
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.isfile(os.path.join(directory, "meta.json")):
+                raise
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError("net cache '%s' has format version %s" % (directory, meta.get("version")))
+        arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r" if mmap else None,
+                                allow_pickle=False) for name in ARRAYS}
+        return cls(arrays, meta["has_walking_area"])
+
+    def route_lengths(self, offsets, edges):
+        """Returns the length of every route of a CSR route set, route i being edges[offsets[i]:offsets[i + 1]]."""
+        counts = np.diff(offsets)
+        lengths = np.zeros(len(counts))
+        # np.add.at accumulates unbuffered in element order, so every sum is bit-identical to sum() over the route
+        np.add.at(lengths, np.repeat(np.arange(len(counts)), counts), self.lengths[edges])
+        return lengths
+
+    def walk_neighbors(self):
+        """
+        Returns for every edge the list of edges a pedestrian may continue on when the driving direction is
+        ignored, in the order net.getShortestPath(..., ignoreDirection=True) visits them.
+        """
+        out_offsets, out_edges = self.out_offsets.tolist(), self.out_edges.tolist()
+        in_offsets, in_edges = self.in_offsets.tolist(), self.in_edges.tolist()
+        node_offsets, node_edges = self.node_in_offsets.tolist(), self.node_in_edges.tolist()
+        neighbors = []
+        for e, to_node in enumerate(self.to_nodes.tolist()):
+            candidates = out_edges[out_offsets[e]:out_offsets[e + 1]] + in_edges[in_offsets[e]:in_offsets[e + 1]]
+            if not self.has_walking_area:
+                candidates += node_edges[node_offsets[to_node]:node_offsets[to_node + 1]]
+            neighbors.append(candidates)
+        return neighbors
+
+    def driving_distances(self, source, limit=math.inf, targets=None):
+        """
+        Returns a dict mapping every edge which passenger cars can reach from edge index source within limit to the
+        distance from the start of source to its start. The search stops once all edges in targets are settled.
+        """
+        if self._successors is None:
+            offsets, edges = self.out_offsets.tolist(), self.out_edges.tolist()
+            self._successors = [edges[offsets[e]:offsets[e + 1]] for e in range(len(offsets) - 1)]
+            self._lengths = self.lengths.tolist()
+            self._passenger = self.passenger.tolist()
+        successors, lengths, passenger = self._successors, self._lengths, self._passenger
+        remaining = len(targets) if targets is not None else -1
+        best = {source: 0.}
+        settled = {}
+        heap = [(0., source)]
+        while heap and remaining:
+            dist, edge = heapq.heappop(heap)
+            if edge in settled:
+                continue
+            settled[edge] = dist
+            if targets is not None and edge in targets:
+                remaining -= 1
+            next_dist = dist + lengths[edge]
+            if next_dist > limit:
+                continue
+            for succ in successors[edge]:
+                if passenger[succ] and next_dist < best.get(succ, math.inf):
+                    best[succ] = next_dist
+                    heapq.heappush(heap, (next_dist, succ))
+        return settled
+
+
+def cache_entry(net_file, cache_dir=None):
+    """Returns the cache directory of net_file, by default .netcache next to the net file."""
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(net_file)), DEFAULT_CACHE_DIR)
+    return os.path.join(cache_dir, "%s-v%s" % (file_hash(net_file), FORMAT_VERSION))
+
+
+def load_snapshot(net_file, cache_dir=None, use_cache=True):
+    """
+    Returns the NetSnapshot of net_file, loaded from the cache if there is a valid entry for its content and
+    otherwise built from the XML (and stored in the cache when use_cache is set).
+    """
+    if not use_cache:
+        return NetSnapshot.from_net(sumolib.net.readNet(net_file))
+    entry = cache_entry(net_file, cache_dir)
+    try:
+        return NetSnapshot.load(entry)
+    except (OSError, ValueError, KeyError):
+        shutil.rmtree(entry, ignore_errors=True)
+    snapshot = NetSnapshot.from_net(sumolib.net.readNet(net_file))
+    snapshot.save(entry, os.path.basename(entry).rsplit("-v", 1)[0])
+    return snapshot
@@ -18,20 +18,297 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
+import contextlib
+import csv
+import heapq
+import io
+import multiprocessing
 import os
+import shutil
 import sys
+import time
+import tracemalloc
 import xml.etree.ElementTree as ET
+from array import array
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
 
 sys.path.append(os.path.join(os.environ["SUMO_HOME"], 'tools'))
 import sumolib  # noqa
 from sumolib.options import ArgumentParser  # noqa
+from netcache import NetSnapshot, cache_entry, load_snapshot  # noqa
 
 
 def parse_args():
     optParser = ArgumentParser()
     optParser.add_argument("net", help="net file")
-    optParser.add_argument("routes", help="route file")
-    return optParser.parse_args()
+    optParser.add_argument("routes", nargs="?", help="route file")
+    optParser.add_argument("--batch", metavar="DIR",
+                           help="evaluate the vehroute outputs of all scenarios below DIR in parallel, "
+                                "writing flow_results.xml next to each of them")
+    optParser.add_argument("--shards", type=int, default=1,
+                           help="split an uncompressed route file into this many parts parsed in parallel")
+    optParser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                           help="number of worker processes for --batch and --shards")
+    optParser.add_argument("--vehicle-output",
+                           help="write the per-vehicle results as columnar NPZ file (see load_vehicle_table)")
+    optParser.add_argument("--percentile-output",
+                           help="write per-flow percentiles of the search distance, search time and walking distance")
+    optParser.add_argument("--percentiles", default="50,95",
+                           help="comma-separated list of percentiles for --percentile-output")
+    optParser.add_argument("--window-output",
+                           help="only stream the metrics per flow and time window into this CSV file, "
+                                "memory stays bounded by flows x windows")
+    optParser.add_argument("--window-size", type=float, default=900.,
+                           help="length of the time windows for --window-output in seconds")
+    optParser.add_argument("--window-by", choices=("depart", "search"), default="depart",
+                           help="assign vehicles to windows by their departure or by their first parking reroute")
+    optParser.add_argument("--benchmark", action="store_true", default=False,
+                           help="compare the streaming vehroute reader with sumolib.xml.parse and the net cache "
+                                "with the XML net parsing and exit")
+    optParser.add_argument("--walk-cache-size", type=int, default=1024,
+                           help="maximum number of source edges whose walking distances are kept in memory")
+    optParser.add_argument("--net-cache", help="directory of the binary net cache (default: .netcache next to the net)")
+    optParser.add_argument("--no-net-cache", action="store_true", default=False,
+                           help="always parse the net XML instead of using the binary net cache")
+    options = optParser.parse_args()
+    options.percentiles = [float(q) for q in options.percentiles.split(",")]
+    if options.routes is None and options.batch is None:
+        optParser.error("either a route file or --batch is required")
+    return options
+
+
+# The subset of a vehroute-output <vehicle> that the evaluation needs. extra_route is None for vehicles
+# without a routeDistribution, otherwise the edges of the final route after the first replacement.
+VehicleRoute = namedtuple("VehicleRoute", ["id", "depart", "arrival", "stopped", "replaced_at", "extra_route"])
+
+
+def _float_or_none(value):
+    return None if value is None else float(value)
+
+
+class _ByteRangeReader:
+    """File-like view of bytes [start, end) of a file, wrapped into a synthetic root element."""
+
+    def __init__(self, path, start, end):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = end - start
+        self._head = b"<routes>"
+        self._tail = b"</routes>"
+
+    def read(self, size=-1):
+        if self._head:
+            head, self._head = self._head, b""
+            return head
+        if self._remaining > 0:
+            data = self._file.read(self._remaining if size < 0 else min(size, self._remaining))
+            self._remaining -= len(data)
+            return data
+        tail, self._tail = self._tail, b""
+        return tail
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._file.close()
+
+
+def shard_vehroutes(routes, shards, chunk_size=1 << 16):
+    """
+    Splits an uncompressed vehroute file into at most shards byte ranges which start at a <vehicle element and
+    together cover all vehicles of the file.
+    """
+    size = os.path.getsize(routes)
+    starts = []
+    with open(routes, "rb") as routes_file:
+        for i in range(shards):
+            routes_file.seek(size * i // shards)
+            buffer = b""
+            while True:
+                chunk = routes_file.read(chunk_size)
+                if not chunk:
+                    break
+                offset = routes_file.tell() - len(buffer) - len(chunk)
+                buffer += chunk
+                pos = buffer.find(b"<vehicle ")
+                if pos >= 0:
+                    if not starts or offset + pos > starts[-1]:
+                        starts.append(offset + pos)
+                    break
+                buffer = buffer[-8:]
+        routes_file.seek(max(0, size - chunk_size))
+        tail = routes_file.read()
+        end = size - len(tail) + tail.rfind(b"</routes>") if b"</routes>" in tail else size
+    return list(zip(starts, starts[1:] + [end]))
+
+
+def parse_vehroutes(routes, byte_range=None):
+    """
+    Streams the vehicles of a (possibly gzipped) vehroute-output file as VehicleRoute tuples, if byte_range is
+    given only the vehicles of that part of an uncompressed file (see shard_vehroutes).
+
+    Only the attributes used by the evaluation are kept and every element is cleared as soon as it has been
+    consumed, so memory is bounded by a single <route> element regardless of the size of the file.
+    """
+    if byte_range is None:
+        routes_file = sumolib.openz(routes, "rb")
+    else:
+        routes_file = _ByteRangeReader(routes, *byte_range)
+    with routes_file:
+        context = ET.iterparse(routes_file, events=("start", "end"))
+        _, root = next(context)
+        depth = 1
+        for event, elem in context:
+            if event == "start":
+                depth += 1
+                if depth == 2 and elem.tag == "vehicle":
+                    stopped = False
+                    in_distribution = False
+                    seen_distribution = False
+                    replace_index = None
+                    replaced_at = None
+                    final_edges = None
+                elif depth == 3 and elem.tag == "routeDistribution" and not seen_distribution:
+                    in_distribution = seen_distribution = True
+                continue
+
+            depth -= 1
+            if depth == 1:
+                if elem.tag == "vehicle":
+                    if seen_distribution:
+                        extra_route = final_edges.split()[replace_index:] if final_edges is not None else []
+                    else:
+                        extra_route = None
+                    yield VehicleRoute(elem.get("id"), _float_or_none(elem.get("depart")),
+                                       _float_or_none(elem.get("arrival")), stopped, replaced_at, extra_route)
+                root.clear()
+            elif depth == 2 and elem.tag == "stop":
+                stopped = True
+            elif depth == 2 and elem.tag == "routeDistribution":
+                in_distribution = False
+            elif depth == 3 and in_distribution and elem.tag == "route":
+                final_edges = elem.get("edges", "")
+                if replace_index is None and elem.get("replacedOnEdge"):
+                    replace_index = len(final_edges.split())
+                    replaced_at = _float_or_none(elem.get("replacedAtTime"))
+                elem.clear()
+
+
+def _parse_vehroutes_sumolib(routes):
+    for vehicle in sumolib.xml.parse(routes, 'vehicle'):
+        if vehicle.routeDistribution:
+            for r in vehicle.routeDistribution[0].route:
+                r.edges.split()
+        yield vehicle
+
+
+def benchmark(net, routes, net_cache=None):
+    start = time.perf_counter()
+    sumolib.net.readNet(net)
+    print("sumolib.net.readNet: %.2f s" % (time.perf_counter() - start))
+    start = time.perf_counter()
+    entry = cache_entry(net, net_cache) + ".benchmark"
+    NetSnapshot.from_net(sumolib.net.readNet(net)).save(entry, "benchmark")
+    print("net cache build: %.2f s" % (time.perf_counter() - start))
+    start = time.perf_counter()
+    NetSnapshot.load(cache_entry(net, net_cache) + ".benchmark")
+    print("net cache load (including the content hash): %.2f s" % (time.perf_counter() - start))
+    shutil.rmtree(entry)
+
+    for name, reader in (("sumolib.xml.parse", _parse_vehroutes_sumolib), ("streaming", parse_vehroutes)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        count = sum(1 for _ in reader(routes))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("%s: %s vehicles in %.2f s, peak memory %.2f MB" % (name, count, elapsed, peak / 2 ** 20))
+
+
+def sequential_totals(groups, values, contributes, count):
+    """
+    Sums values per group in input order, matching a Python += loop exactly. Groups without any contributing
+    value stay the integer 0 the loop started with, so the written results do not change their formatting.
+    """
+    totals = np.zeros(count)
+    np.add.at(totals, groups, values)
+    contributed = np.bincount(groups[contributes], minlength=count) > 0
+    return [float(total) if c else 0 for total, c in zip(totals, contributed)]
+
+
+class WalkingDistanceIndex:
+    """
+    Walking distances between the edges of a network snapshot, ignoring the driving direction like
+    net.getShortestPath(..., ignoreDirection=True) does.
+
+    The first lookup for a source edge runs one Dijkstra search to all edges of the network, later lookups
+    from the same source (e.g. the same parking area) are answered from that tree. At most max_sources trees
+    are kept, the least recently used one is evicted first.
+    """
+
+    def __init__(self, net, max_sources=1024):
+        self._index = net.index
+        self._lengths = net.lengths.tolist()
+        self._neighbors = net.walk_neighbors()
+        self._trees = OrderedDict()
+        self.max_sources = max_sources
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def walking_distance(self, from_edge, to_edge):
+        """Returns the summed length of the edges on the walk from from_edge to to_edge or None if unreachable."""
+        tree = self._trees.get(from_edge)
+        if tree is None:
+            self.misses += 1
+            tree = self._search(self._index[from_edge])
+            self._trees[from_edge] = tree
+            if len(self._trees) > self.max_sources:
+                self._trees.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            self._trees.move_to_end(from_edge)
+        return tree[self._index[to_edge]]
+
+    def _search(self, source):
+        # mirrors sumolib.net.Net.getOptimalPath with ignoreDirection=True so that ties are broken identically
+        lengths = self._lengths
+        neighbors = self._neighbors
+        dist = {source: (0., None)}
+        walk = [None] * len(lengths)
+        seen = set()
+        q = [(0., source, -1)]
+        while q:
+            cost, e1, _ = heapq.heappop(q)
+            if e1 in seen:
+                continue
+            seen.add(e1)
+            pred = dist[e1][1]
+            walk[e1] = lengths[e1] if pred is None else walk[pred] + lengths[e1]
+            for e2 in neighbors[e1]:
+                if e2 not in seen:
+                    newCost = cost + lengths[e2]
+                    if e2 not in dist or newCost < dist[e2][0]:
+                        dist[e2] = (newCost, e1)
+                        heapq.heappush(q, (newCost, e2, e1))
+        return walk
+
+    def counters(self):
+        return self.hits, self.misses, self.evictions
+
+    def __str__(self):
+        return walk_index_report(*self.counters())
+
+
+def walk_index_report(hits, misses, evictions):
+    lookups = hits + misses
+    return "Walking distance index: %s lookups, %s hits (%.1f%%), %s misses, %s evictions" % (
+        lookups, hits, 100. * hits / lookups if lookups else 0., misses, evictions)
 
 
 def write_results_to_xml(flow_results, total_summary, output_file):
@@ -57,89 +334,392 @@ def write_results_to_xml(flow_results, total_summary, output_file):
     tree.write(output_file)
 
 
-def main(net, routes):
-    net = sumolib.net.readNet(net)
+# Per-vehicle evaluation results in the order of the vehroute file. flow holds indices into flow_ids, the search
+# columns are 0 for vehicles which did not arrive or never searched.
+VehicleTable = namedtuple("VehicleTable", ["flow_ids", "vehicle_ids", "flow", "depart", "arrival", "arrived",
+                                           "searched", "search_distance", "search_time", "walk_distance",
+                                           "route_nonempty", "walk_found"])
+
+
+def collect_vehicles(net, vehicles, walk_index):
+    """Evaluates the VehicleRoute tuples against the given NetSnapshot and returns them as a VehicleTable."""
+    flow_index = {}  # flow id -> index in order of first appearance
+    vehicle_ids = []
+    flows = array('q')
+    departs = array('d')
+    arrivals = array('d')
+    arrived = array('b')
+    searched = array('b')
+    search_times = array('d')
+    walk_lengths = array('d')
+    walk_found = array('b')
+    # the extra routes are kept as CSR (offsets into route_edges)
+    route_offsets = array('q', [0])
+    route_edges = array('q')
+
+    for vehicle in vehicles:
+        flow_id = vehicle.id.split('.')[0]  # Identify flow by ID before "."
+        vehicle_ids.append(vehicle.id)
+        flows.append(flow_index.setdefault(flow_id, len(flow_index)))
+        departs.append(vehicle.depart if vehicle.depart is not None else np.nan)
+        arrivals.append(vehicle.arrival if vehicle.arrival is not None else np.nan)
+        arrived.append(vehicle.stopped)
+        extra_route = vehicle.extra_route if vehicle.stopped else None
+        searched.append(extra_route is not None)
+        walk_length = None
+
+        if not vehicle.stopped:
+            print("Warning! Vehicle '%s' did not arrive." % vehicle.id)
+            search_times.append(0.)
+        elif extra_route is not None:
+            search_times.append(vehicle.arrival - vehicle.depart)
+            route_edges.extend([net.index[e] for e in extra_route])
+            if extra_route:
+                walk_length = walk_index.walking_distance(extra_route[-1], extra_route[0])
+                if walk_length is None:
+                    print("Warning! No walking path from '%s' to '%s' for vehicle '%s'." %
+                          (extra_route[-1], extra_route[0], vehicle.id))
+        else:
+            search_times.append(0.)
+        walk_lengths.append(walk_length or 0.)
+        walk_found.append(walk_length is not None)
+        route_offsets.append(len(route_edges))
+
+    # the array buffers are handed over to NumPy without copying
+    route_offsets = np.asarray(route_offsets)
+    return VehicleTable(list(flow_index), vehicle_ids, np.asarray(flows), np.asarray(departs), np.asarray(arrivals),
+                        np.asarray(arrived).astype(bool), np.asarray(searched).astype(bool),
+                        net.route_lengths(route_offsets, np.asarray(route_edges)), np.asarray(search_times),
+                        np.asarray(walk_lengths), np.diff(route_offsets) > 0, np.asarray(walk_found).astype(bool))
+
+
+def merge_vehicle_tables(tables):
+    """Concatenates VehicleTables of consecutive parts of one vehroute file into the table of the whole file."""
+    flow_index = {}
+    flows = []
+    for table in tables:
+        remap = np.array([flow_index.setdefault(flow_id, len(flow_index)) for flow_id in table.flow_ids],
+                         dtype=np.int64)
+        flows.append(remap[table.flow])
+    columns = [np.concatenate([getattr(table, name) for table in tables])
+               for name in VehicleTable._fields[4:]]
+    return VehicleTable(list(flow_index), [vehicle_id for table in tables for vehicle_id in table.vehicle_ids],
+                        np.concatenate(flows), np.concatenate([table.depart for table in tables]), *columns)
+
+
+def summarize(table):
+    """
+    Returns the per-flow results, the summary over all vehicles and the distance, time and walking distance
+    Statistics of a VehicleTable.
+    """
     dist = sumolib.miscutils.Statistics("Distance")
     time = sumolib.miscutils.Statistics("Time")
     walk_dist = sumolib.miscutils.Statistics("Walking Distance")
+    arrived = table.arrived
+    for vehicle_id, length, elapsed_time, walk_length in zip(
+            [v for v, a in zip(table.vehicle_ids, arrived.tolist()) if a], table.search_distance[arrived].tolist(),
+            table.search_time[arrived].tolist(), table.walk_distance[arrived].tolist()):
+        dist.add(length, vehicle_id)
+        time.add(elapsed_time, vehicle_id)
+        walk_dist.add(walk_length, vehicle_id)
 
-    flow_results = {}
+    num_flows = len(table.flow_ids)
+    arrived_flows = table.flow[arrived]
+    vehicles = np.bincount(table.flow, minlength=num_flows)
+    not_arrived = vehicles - np.bincount(arrived_flows, minlength=num_flows)
+    search_distance = table.search_distance[arrived]
+    search_time = table.search_time[arrived]
+    walk_distance = table.walk_distance[arrived]
+    nonempty = table.route_nonempty[arrived]
+    searched = table.searched[arrived]
+    walk_found = table.walk_found[arrived]
+    columns = {
+        "total_vehicles": vehicles.tolist(),
+        "total_distance": sequential_totals(arrived_flows, search_distance, nonempty, num_flows),
+        "total_time": sequential_totals(arrived_flows, search_time, searched, num_flows),
+        "total_walking_distance": sequential_totals(arrived_flows, walk_distance, walk_found, num_flows),
+        "not_arrived": not_arrived.tolist(),
+    }
+    flow_results = {flow_id: {key: values[flow] for key, values in columns.items()}
+                    for flow, flow_id in enumerate(table.flow_ids)}
+    summary_group = np.zeros(len(arrived_flows), dtype=np.int64)
     total_summary = {
-        "total_vehicles": 0,
-        "total_distance": 0,
-        "total_time": 0,
-        "total_walking_distance": 0,
-        "not_arrived": 0
+        "total_vehicles": len(table.flow),
+        "total_distance": sequential_totals(summary_group, search_distance, nonempty, 1)[0],
+        "total_time": sequential_totals(summary_group, search_time, searched, 1)[0],
+        "total_walking_distance": sequential_totals(summary_group, walk_distance, walk_found, 1)[0],
+        "not_arrived": int(not_arrived.sum()),
     }
+    return flow_results, total_summary, (dist, time, walk_dist)
 
-    for vehicle in sumolib.xml.parse(routes, 'vehicle'):
-        flow_id = vehicle.id.split('.')[0]  # Identify flow by ID before "."
 
-        if flow_id not in flow_results:
-            flow_results[flow_id] = {
-                "total_vehicles": 0,
-                "total_distance": 0,
-                "total_time": 0,
-                "total_walking_distance": 0,
-                "not_arrived": 0
-            }
+class WindowAggregator:
+    """
+    Sums the search metrics of streamed vehicles per flow and fixed time window. Vehicles are assigned to the
+    window of their departure (by="depart") or of their first parking reroute (by="search", vehicles which
+    never searched count at their departure). Memory grows with flows times windows, not with vehicles.
+    """
+
+    FIELDS = ("vehicles", "search_distance", "search_time", "walking_distance", "not_arrived")
 
-        flow_results[flow_id]["total_vehicles"] += 1
-        total_summary["total_vehicles"] += 1
+    def __init__(self, net, walk_index, window_size=900., by="depart"):
+        self._index = net.index
+        self._lengths = net.lengths.tolist()
+        self._walk_index = walk_index
+        self.window_size = window_size
+        self.by = by
+        self._bins = {}  # (flow id, window index) -> sums in the order of FIELDS
 
-        if not vehicle.stop:
+    def add(self, vehicle):
+        flow_id = vehicle.id.split('.')[0]  # Identify flow by ID before "."
+        if self.by == "search" and vehicle.replaced_at is not None:
+            when = vehicle.replaced_at
+        else:
+            when = vehicle.depart
+        key = (flow_id, int(when // self.window_size))
+        sums = self._bins.get(key)
+        if sums is None:
+            sums = self._bins[key] = [0, 0., 0., 0., 0]
+        sums[0] += 1
+        if not vehicle.stopped:
             print("Warning! Vehicle '%s' did not arrive." % vehicle.id)
-            flow_results[flow_id]["not_arrived"] += 1
-            total_summary["not_arrived"] += 1
-            continue
+            sums[4] += 1
+            return
+        extra_route = vehicle.extra_route
+        if extra_route is not None:
+            sums[1] += sum([self._lengths[self._index[e]] for e in extra_route])
+            sums[2] += vehicle.arrival - vehicle.depart
+            if extra_route:
+                walk_length = self._walk_index.walking_distance(extra_route[-1], extra_route[0])
+                if walk_length is None:
+                    print("Warning! No walking path from '%s' to '%s' for vehicle '%s'." %
+                          (extra_route[-1], extra_route[0], vehicle.id))
+                else:
+                    sums[3] += walk_length
 
-        if vehicle.routeDistribution and vehicle.stop:
-            replace_index = None
-            for r in vehicle.routeDistribution[0].route:
-                if replace_index is None and r.replacedOnEdge:
-                    replace_index = len(r.edges.split())
-                    replace_time = r.replacedAtTime
-            extra_route = r.edges.split()[replace_index:]
-            length = sum([net.getEdge(e).getLength() for e in extra_route])
-            dist.add(length, vehicle.id)
-            flow_results[flow_id]["total_distance"] += length
-            total_summary["total_distance"] += length
-
-            depart_time = float(vehicle.depart)
-            arrival_time = float(vehicle.arrival)
-            elapsed_time = arrival_time - depart_time
-            time.add(elapsed_time, vehicle.id)
-            flow_results[flow_id]["total_time"] += elapsed_time
-            total_summary["total_time"] += elapsed_time
+    def write_csv(self, output_file):
+        """Writes one row per flow and non-empty window, flows in order of appearance and windows ascending."""
+        flow_order = {}
+        for flow_id, _ in self._bins:
+            flow_order.setdefault(flow_id, len(flow_order))
+        with open(output_file, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("flow_id", "begin", "end") + self.FIELDS)
+            for flow_id, window in sorted(self._bins, key=lambda key: (flow_order[key[0]], key[1])):
+                writer.writerow([flow_id, window * self.window_size, (window + 1) * self.window_size] +
+                                self._bins[(flow_id, window)])
 
-            if extra_route:
-                walk, _ = net.getShortestPath(net.getEdge(extra_route[-1]), net.getEdge(extra_route[0]),
-                                              ignoreDirection=True)
-                walk_length = sum([e.getLength() for e in walk])
-            else:
-                walk_length = 0
-
-            walk_dist.add(walk_length, vehicle.id)
-            flow_results[flow_id]["total_walking_distance"] += walk_length
-            total_summary["total_walking_distance"] += walk_length
-        else:
-            dist.add(0, vehicle.id)
-            time.add(0, vehicle.id)
-            walk_dist.add(0, vehicle.id)
-            flow_results[flow_id]["total_distance"] += 0
-            flow_results[flow_id]["total_time"] += 0
-            flow_results[flow_id]["total_walking_distance"] += 0
 
-    print(dist)
-    print(time)
-    print(walk_dist)
+def aggregate_windows(net, routes, walk_index, output_file, window_size=900., by="depart"):
+    """Streams a vehroute output through a WindowAggregator and writes the resulting time series as CSV."""
+    aggregator = WindowAggregator(net, walk_index, window_size, by)
+    for vehicle in parse_vehroutes(routes):
+        aggregator.add(vehicle)
+    print(walk_index)
+    aggregator.write_csv(output_file)
+    print(f"Time series exported to {output_file}")
+
+
+def grouped_percentiles(groups, values, count, percentiles):
+    """
+    Returns a (count, len(percentiles)) array with the percentiles of values per group, interpolated linearly
+    like np.percentile. Groups without values get NaN.
+    """
+    order = np.lexsort((values, groups))
+    sorted_values = np.append(values[order], np.nan)
+    sizes = np.bincount(groups, minlength=count)
+    starts = np.cumsum(sizes) - sizes
+    positions = (sizes[:, None] - 1) * (np.asarray(percentiles, dtype=np.float64)[None, :] / 100.)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, sizes[:, None] - 1)
+    empty = sizes[:, None] == 0
+    lower_values = sorted_values[np.where(empty, -1, starts[:, None] + lower)]
+    upper_values = sorted_values[np.where(empty, -1, starts[:, None] + upper)]
+    return lower_values + (upper_values - lower_values) * (positions - lower)
+
+
+PERCENTILE_METRICS = (("SearchDistance", "search_distance"), ("SearchTime", "search_time"),
+                      ("WalkingDistance", "walk_distance"))
+
+
+def write_percentiles_to_xml(table, percentiles, output_file):
+    """Writes the percentiles of the search distance, search time and walking distance of arrived vehicles."""
+    arrived = table.arrived
+    flows = table.flow[arrived]
+    num_flows = len(table.flow_ids)
+    root = ET.Element("Percentiles")
+    per_metric = []
+    for tag, column in PERCENTILE_METRICS:
+        values = getattr(table, column)[arrived]
+        per_metric.append((tag, grouped_percentiles(np.zeros(len(values), dtype=np.int64), values, 1, percentiles),
+                           grouped_percentiles(flows, values, num_flows, percentiles)))
+    summary = ET.SubElement(root, "Summary")
+    for tag, summary_values, _ in per_metric:
+        ET.SubElement(summary, tag, {"p%g" % q: str(v) for q, v in zip(percentiles, summary_values[0].tolist())})
+    for flow, flow_id in enumerate(table.flow_ids):
+        flow_element = ET.SubElement(root, "Flow", id=flow_id)
+        for tag, _, flow_values in per_metric:
+            ET.SubElement(flow_element, tag,
+                          {"p%g" % q: str(v) for q, v in zip(percentiles, flow_values[flow].tolist())})
+    ET.ElementTree(root).write(output_file)
+
+
+def write_vehicle_table(table, output_file):
+    """
+    Writes a VehicleTable as NPZ with one array per column. flow holds indices into the flow_ids array, all
+    other arrays have one entry per vehicle.
+    """
+    np.savez(output_file, **{name: np.asarray(getattr(table, name)) for name in VehicleTable._fields})
+
+
+def load_vehicle_table(input_file):
+    """Reads a VehicleTable written by write_vehicle_table."""
+    with np.load(input_file, allow_pickle=False) as data:
+        columns = {name: data[name] for name in VehicleTable._fields}
+    columns["flow_ids"] = columns["flow_ids"].tolist()
+    columns["vehicle_ids"] = columns["vehicle_ids"].tolist()
+    return VehicleTable(**columns)
+
+
+def write_outputs(table, walk_report, output_file, vehicle_output=None, percentile_output=None,
+                  percentiles=(50, 95)):
+    flow_results, total_summary, statistics = summarize(table)
+    for stats in statistics:
+        print(stats)
+    print(walk_report)
 
     # Export results to XML
-    output_file = "./output/flow_results.xml"
     write_results_to_xml(flow_results, total_summary, output_file)
     print(f"Results exported to {output_file}")
+    if vehicle_output:
+        write_vehicle_table(table, vehicle_output)
+        print(f"Vehicle table exported to {vehicle_output}")
+    if percentile_output:
+        write_percentiles_to_xml(table, percentiles, percentile_output)
+        print(f"Percentiles exported to {percentile_output}")
+
+
+def main(net, routes, walk_cache_size=1024, net_cache=None, use_net_cache=True,
+         output_file="./output/flow_results.xml", shards=1, jobs=None, vehicle_output=None, percentile_output=None,
+         percentiles=(50, 95)):
+    if shards > 1 and not routes.endswith(".gz"):
+        table, walk_report = evaluate_sharded(net, routes, shards, jobs, walk_cache_size, net_cache, use_net_cache)
+    else:
+        net = load_snapshot(net, net_cache, use_net_cache)
+        walk_index = WalkingDistanceIndex(net, walk_cache_size)
+        table = collect_vehicles(net, parse_vehroutes(routes), walk_index)
+        walk_report = str(walk_index)
+    write_outputs(table, walk_report, output_file, vehicle_output, percentile_output, percentiles)
+
+
+def find_vehroute_files(main_directory):
+    """Returns all vehroute outputs (vehroute*.xml, optionally gzipped) below main_directory."""
+    vehroute_files = []
+    for root, _, files in os.walk(main_directory):
+        for file in files:
+            if file.startswith("vehroute") and file.endswith((".xml", ".xml.gz")):
+                vehroute_files.append(os.path.join(root, file))
+    return sorted(vehroute_files)
+
+
+# set by _init_worker, with the fork start method the workers inherit the parent's snapshot copy-on-write
+_worker_net = None
+_worker_walk_index = None
+
+
+def _init_worker(net_file, net_cache, use_net_cache, walk_cache_size):
+    global _worker_net, _worker_walk_index
+    if _worker_net is None:
+        _worker_net = load_snapshot(net_file, net_cache, use_net_cache)
+    _worker_walk_index = WalkingDistanceIndex(_worker_net, walk_cache_size)
+
+
+def _evaluate_scenario(routes, vehicle_output, percentile_output, percentiles):
+    start = time.perf_counter()
+    log = io.StringIO()
+    directory = os.path.dirname(routes)
+    # the index of the worker lives across scenarios, only the lookups of this scenario are reported
+    before = _worker_walk_index.counters()
+    with contextlib.redirect_stdout(log):
+        table = collect_vehicles(_worker_net, parse_vehroutes(routes), _worker_walk_index)
+        counters = [after - b for after, b in zip(_worker_walk_index.counters(), before)]
+        write_outputs(table, walk_index_report(*counters), os.path.join(directory, "flow_results.xml"),
+                      vehicle_output and os.path.join(directory, vehicle_output),
+                      percentile_output and os.path.join(directory, percentile_output), percentiles)
+    return routes, log.getvalue(), time.perf_counter() - start
+
+
+def _collect_shard(routes, byte_range):
+    log = io.StringIO()
+    before = _worker_walk_index.counters()
+    with contextlib.redirect_stdout(log):
+        table = collect_vehicles(_worker_net, parse_vehroutes(routes, byte_range), _worker_walk_index)
+    counters = [after - b for after, b in zip(_worker_walk_index.counters(), before)]
+    return table, log.getvalue(), counters
+
+
+def _pool(net, jobs, walk_cache_size, net_cache, use_net_cache, tasks):
+    global _worker_net
+    _worker_net = load_snapshot(net, net_cache, use_net_cache)
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    return ProcessPoolExecutor(min(jobs or os.cpu_count(), tasks), context,
+                               _init_worker, (net, net_cache, use_net_cache, walk_cache_size))
+
+
+def evaluate_sharded(net, routes, shards, jobs=None, walk_cache_size=1024, net_cache=None, use_net_cache=True):
+    """
+    Parses byte-range shards of one uncompressed vehroute file on a process pool and merges the per-vehicle
+    results in file order, so all totals and statistics derived from them equal those of a serial run.
+    Returns the merged VehicleTable and the combined report of the walking distance indices.
+    """
+    byte_ranges = shard_vehroutes(routes, shards)
+    tables = []
+    counters = [0, 0, 0]
+    with _pool(net, jobs, walk_cache_size, net_cache, use_net_cache, len(byte_ranges)) as executor:
+        for table, log, shard_counters in executor.map(_collect_shard, [routes] * len(byte_ranges), byte_ranges):
+            print(log, end="")
+            tables.append(table)
+            counters = [c + s for c, s in zip(counters, shard_counters)]
+    return merge_vehicle_tables(tables), walk_index_report(*counters)
+
+
+def batch(net, main_directory, jobs=None, walk_cache_size=1024, net_cache=None, use_net_cache=True,
+          vehicle_output=None, percentile_output=None, percentiles=(50, 95)):
+    """
+    Evaluates every vehroute output below main_directory on a process pool and writes each flow_results.xml
+    (and the optional vehicle table and percentiles, using the base names of the given files) next to its
+    vehroute file. The network snapshot is loaded once before the workers start.
+    """
+    vehicle_output = vehicle_output and os.path.basename(vehicle_output)
+    percentile_output = percentile_output and os.path.basename(percentile_output)
+    start = time.perf_counter()
+    vehroute_files = find_vehroute_files(main_directory)
+    if not vehroute_files:
+        print("No vehroute outputs found below '%s'." % main_directory)
+        return
+    with _pool(net, jobs, walk_cache_size, net_cache, use_net_cache, len(vehroute_files)) as executor:
+        futures = [executor.submit(_evaluate_scenario, routes, vehicle_output, percentile_output, percentiles)
+                   for routes in vehroute_files]
+        for future in as_completed(futures):
+            routes, log, elapsed = future.result()
+            print("=== %s (%.2f s)" % (routes, elapsed))
+            print(log, end="")
+    print("Evaluated %s scenarios in %.2f s." % (len(vehroute_files), time.perf_counter() - start))
 
 
 if __name__ == "__main__":
     options = parse_args()
-    main(options.net, options.routes)
+    if options.benchmark:
+        benchmark(options.net, options.routes, options.net_cache)
+    elif options.window_output:
+        net = load_snapshot(options.net, options.net_cache, not options.no_net_cache)
+        aggregate_windows(net, options.routes, WalkingDistanceIndex(net, options.walk_cache_size),
+                          options.window_output, options.window_size, options.window_by)
+    elif options.batch:
+        batch(options.net, options.batch, options.jobs, options.walk_cache_size, options.net_cache,
+              not options.no_net_cache, options.vehicle_output, options.percentile_output, options.percentiles)
+    else:
+        main(options.net, options.routes, options.walk_cache_size, options.net_cache, not options.no_net_cache,
+             shards=options.shards, jobs=options.jobs, vehicle_output=options.vehicle_output,
+             percentile_output=options.percentile_output, percentiles=options.percentiles)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Eclipse SUMO, Simulation of Urban MObility; see https://eclipse.dev/sumo
+# Copyright (C) 2008-2023 German Aerospace Center (DLR) and others.
+# This program and the accompanying materials are made available under the
+# terms of the Eclipse Public License 2.0 which is available at
+# https://www.eclipse.org/legal/epl-2.0/
+# This Source Code may also be made available under the following Secondary
+# Licenses when the conditions for such availability set forth in the Eclipse
+# Public License 2.0 are satisfied: GNU General Public License, version 2
+# or later which is available at
+# https://www.gnu.org/licenses/old-licenses/gpl-2.0-standalone.html
+# SPDX-License-Identifier: EPL-2.0 OR GPL-2.0-or-later
+
+# This tool evaluates the parking search of a scenario from its tripinfo and stop output alone, without
+# vehroute output and without loading the network. It writes the flow_results.xml schema of
+# parkingSearchTraffic.py, so compare_flow_results.py can read the results, but the distances below are estimates
+# which are not comparable with the results of parkingSearchTraffic.py.
+# As in parkingSearchTraffic.py a vehicle arrived if it reached a parking stop and searched if its route was
+# replaced after departure. The routing device already counts the routing at insertion in rerouteNo, which is
+# therefore discounted for vehicles with that device. The search time is the trip duration of searching vehicles,
+# the distance is their whole routeLength because the part driven before the first reroute is not known without
+# vehroute output, and the walking distance is always 0 as it needs the network.
+# @file    parkingSearchTripinfo.py
+# @author  Mohamed Abdulmaksoud
+# @date    2026-10-17
+
+from __future__ import absolute_import
+from __future__ import print_function
+import csv
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+sys.path.append(os.path.join(os.environ["SUMO_HOME"], 'tools'))
+import sumolib  # noqa
+from sumolib.options import ArgumentParser  # noqa
+
+# the elements written after the five of parkingSearchTraffic.py, which compare_flow_results.py ignores
+EXTRA_TAGS = (("time_to_stop", "TotalTimeToStop"), ("waiting_time", "TotalWaitingTime"),
+              ("reroutes", "TotalReroutes"), ("other_parking_area", "OtherParkingArea"))
+VEHICLE_COLUMNS = ("id", "flow_id", "depart", "stop_started", "stop_ended", "time_to_stop", "reroute_no",
+                   "waiting_time", "route_length", "requested_parking_area", "parking_area")
+
+
+def parse_args():
+    optParser = ArgumentParser()
+    optParser.add_argument("tripinfo", help="tripinfo-output file")
+    optParser.add_argument("stopinfo", help="stop-output file")
+    optParser.add_argument("-r", "--routes",
+                           help="route file with the requested parking area as first parkingArea stop of every "
+                                "flow or vehicle, enables the comparison with the parking area actually used")
+    optParser.add_argument("-o", "--output", default="./output/flow_results.xml", help="flow results file")
+    optParser.add_argument("--vehicle-output", help="write the per-vehicle metrics as CSV file")
+    return optParser.parse_args()
+
+
+def iter_elements(path, tag):
+    """
+    Streams the attributes of all top level elements with the given tag of a (possibly gzipped) SUMO output file.
+    Every element is cleared as soon as it has been read, so memory does not grow with the size of the file.
+    """
+    with sumolib.openz(path, "rb") as f:
+        context = ET.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        depth = 1
+        for event, elem in context:
+            if event == "start":
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                if elem.tag == tag:
+                    yield elem.attrib
+                root.clear()
+
+
+def read_parking_stops(stopinfo):
+    """Returns for every vehicle with a parking area stop the area, begin and end of its first one."""
+    stops = {}
+    for attrs in iter_elements(stopinfo, "stopinfo"):
+        parking_area = attrs.get("parkingArea")
+        if parking_area and attrs["id"] not in stops:
+            stops[attrs["id"]] = (parking_area, float(attrs["started"]), float(attrs["ended"]))
+    return stops
+
+
+def read_requested_parking_areas(routes):
+    """Returns the parking area of the first parkingArea stop of every flow and vehicle in the route file."""
+    requested = {}
+    with sumolib.openz(routes, "rb") as f:
+        context = ET.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        depth = 1
+        for event, elem in context:
+            if event == "start":
+                depth += 1
+                if depth == 2:
+                    owner = elem.get("id") if elem.tag in ("flow", "vehicle") else None
+                continue
+            depth -= 1
+            if depth == 2 and elem.tag == "stop" and owner is not None and elem.get("parkingArea"):
+                requested.setdefault(owner, elem.get("parkingArea"))
+            elif depth == 1:
+                root.clear()
+    return requested
+
+
+def _new_result():
+    return dict(total_vehicles=0, total_distance=0, total_time=0, total_walking_distance=0, not_arrived=0,
+                time_to_stop=0, waiting_time=0, reroutes=0, other_parking_area=0)
+
+
+def analyze(tripinfo, stopinfo, requested=None, vehicle_writer=None):
+    """
+    Evaluates the tripinfo and stop output and returns the per-flow results and the summary over all vehicles.
+    The stop output is read first and kept as one tuple per parked vehicle, the much larger tripinfo output is
+    streamed. Vehicles which parked but are missing in the tripinfo output (unfinished at the end of the
+    simulation) count as arrived vehicles without trip metrics.
+    """
+    stops = read_parking_stops(stopinfo)
+    requested = requested or {}
+    flow_results = {}
+    total_summary = _new_result()
+
+    def add(vehicle_id, depart, duration, reroute_no, waiting_time, route_length):
+        flow_id = vehicle_id.split('.')[0]  # Identify flow by ID before "."
+        requested_area = requested.get(vehicle_id, requested.get(flow_id))
+        stop = stops.pop(vehicle_id, None)
+        time_to_stop = stop[1] - depart if stop is not None and depart is not None else None
+        for result in (flow_results.setdefault(flow_id, _new_result()), total_summary):
+            result["total_vehicles"] += 1
+            if stop is None:
+                result["not_arrived"] += 1
+                continue
+            if reroute_no:
+                result["total_distance"] += route_length
+                result["total_time"] += duration
+            result["time_to_stop"] += time_to_stop or 0
+            result["waiting_time"] += waiting_time
+            result["reroutes"] += reroute_no
+            if requested_area is not None and stop[0] != requested_area:
+                result["other_parking_area"] += 1
+        if stop is None:
+            print("Warning! Vehicle '%s' did not arrive." % vehicle_id)
+        if vehicle_writer is not None:
+            vehicle_writer.writerow([vehicle_id, flow_id, depart, stop and stop[1], stop and stop[2], time_to_stop,
+                                     reroute_no, waiting_time, route_length, requested_area, stop and stop[0]])
+
+    for attrs in iter_elements(tripinfo, "tripinfo"):
+        reroute_no = int(attrs.get("rerouteNo", 0))
+        if reroute_no and "routing_" in attrs.get("devices", ""):
+            reroute_no -= 1
+        add(attrs["id"], float(attrs["depart"]), float(attrs["duration"]), reroute_no,
+            float(attrs.get("waitingTime", 0)), float(attrs.get("routeLength", 0)))
+    for vehicle_id in list(stops):
+        add(vehicle_id, None, 0, 0, 0, 0)
+    return flow_results, total_summary
+
+
+def write_results_to_xml(flow_results, total_summary, output_file):
+    root = ET.Element("Results")
+    for name, data, attrs in [("Summary", total_summary, {})] + [("Flow", data, {"id": flow_id})
+                                                                 for flow_id, data in flow_results.items()]:
+        element = ET.SubElement(root, name, attrs)
+        ET.SubElement(element, "TotalVehicles").text = str(data["total_vehicles"])
+        ET.SubElement(element, "TotalDistance").text = str(data["total_distance"])
+        ET.SubElement(element, "TotalTime").text = str(data["total_time"])
+        ET.SubElement(element, "TotalWalkingDistance").text = str(data["total_walking_distance"])
+        ET.SubElement(element, "NotArrived").text = str(data["not_arrived"])
+        for key, tag in EXTRA_TAGS:
+            ET.SubElement(element, tag).text = str(data[key])
+    ET.ElementTree(root).write(output_file)
+
+
+def main(tripinfo, stopinfo, routes=None, output_file="./output/flow_results.xml", vehicle_output=None):
+    requested = read_requested_parking_areas(routes) if routes else None
+    if vehicle_output:
+        with open(vehicle_output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(VEHICLE_COLUMNS)
+            flow_results, total_summary = analyze(tripinfo, stopinfo, requested, writer)
+    else:
+        flow_results, total_summary = analyze(tripinfo, stopinfo, requested)
+    write_results_to_xml(flow_results, total_summary, output_file)
+    print("Vehicles: %s, not arrived: %s, searched time: %s, parked at another area: %s" %
+          (total_summary["total_vehicles"], total_summary["not_arrived"], total_summary["total_time"],
+           total_summary["other_parking_area"]))
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    main(options.tripinfo, options.stopinfo, options.routes, options.output, options.vehicle_output)
@@ -0,0 +1,148 @@
+# Runs every scenario of a sweep (each subdirectory with its own osm.sumocfg, e.g. the Dortmund scenarios) as a
+# headless SUMO process instead of starting them one after the other with run.bat and sumo-gui. At most --jobs
+# simulations (by default one per core) run at the same time, every scenario writes its outputs and the SUMO log
+# to its own output/ directory, so the results land where parkingSearchTripinfo.py and compare_flow_results.py
+# expect them. The scenarios which took longest in the previous sweep (clockDuration of their statistic output)
+# are started first, so a sweep with enough cores takes about as long as its slowest scenario.
+# With --evaluate parkingSearchTripinfo.py writes output/flow_results_tripinfo.xml after every simulation. These
+# results are estimated from the tripinfo and stop output (whole route lengths, no walking distances) and are not
+# comparable with the flow_results.xml of parkingSearchTraffic.py, so they never replace it and
+# compare_flow_results.py, which only collects flow_results.xml, does not mix them in.
+# Arguments which are not known here are passed on to every SUMO instance (e.g. --end 3600).
+# @file    run_scenarios.py
+# @author  Mohamed Abdulmaksoud
+# @date    2026-10-17
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.join(os.environ["SUMO_HOME"], 'tools'))
+import sumolib  # noqa
+
+# SUMO output option -> file name in the output/ directory of the scenario
+OUTPUTS = {
+    "tripinfo": "tripinfos.xml",
+    "stop": "stopinfo.xml",
+    "statistic": "statistics.xml",
+    "vehroute": "vehroutes.xml",
+    "summary": "summary.xml",
+    "emission": "emissions.xml",
+}
+DEFAULT_OUTPUTS = "tripinfo,stop,statistic"
+LOG_FILE = "sumo.log"
+EVALUATION_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parkingSearchTripinfo.py")
+EVALUATION_OUTPUT = "flow_results_tripinfo.xml"
+
+
+def find_scenarios(main_directory, config_name="osm.sumocfg"):
+    """Returns the sorted scenario directories below main_directory which contain config_name."""
+    return sorted(os.path.join(main_directory, name) for name in os.listdir(main_directory)
+                  if os.path.isfile(os.path.join(main_directory, name, config_name)))
+
+
+def previous_duration(scenario):
+    """Returns the wall-clock seconds of the last run of the scenario from its statistic output, 0 if unknown."""
+    try:
+        performance = ET.parse(os.path.join(scenario, "output", OUTPUTS["statistic"])).find("performance")
+        return float(performance.get("clockDuration"))
+    except (OSError, ET.ParseError, AttributeError, TypeError, ValueError):
+        return 0.
+
+
+def sumo_command(binary, config_name, outputs, sumo_args=()):
+    command = [binary, "-c", config_name, "--no-step-log"]
+    for output in outputs:
+        command += ["--%s-output" % output, os.path.join("output", OUTPUTS[output])]
+    if "vehroute" in outputs:
+        # parkingSearchTraffic.py needs the exit times of the edges
+        command += ["--vehroute-output.exit-times"]
+    return command + list(sumo_args)
+
+
+def run_scenario(scenario, command, evaluate=False, evaluation_output=EVALUATION_OUTPUT):
+    """Runs one scenario in its directory and returns its exit code and the wall-clock seconds it took."""
+    os.makedirs(os.path.join(scenario, "output"), exist_ok=True)
+    start = time.perf_counter()
+    with open(os.path.join(scenario, "output", LOG_FILE), "w") as log:
+        returncode = subprocess.call(command, cwd=scenario, stdout=log, stderr=subprocess.STDOUT)
+        if returncode == 0 and evaluate:
+            evaluation = [sys.executable, EVALUATION_SCRIPT, os.path.join("output", OUTPUTS["tripinfo"]),
+                          os.path.join("output", OUTPUTS["stop"]), "-o", os.path.join("output", evaluation_output)]
+            returncode = subprocess.call(evaluation, cwd=scenario, stdout=log, stderr=subprocess.STDOUT)
+    return returncode, time.perf_counter() - start
+
+
+def main(main_directory, scenarios=None, jobs=None, config_name="osm.sumocfg", outputs=DEFAULT_OUTPUTS,
+         evaluate=False, evaluation_output=EVALUATION_OUTPUT, sumo_args=()):
+    found = find_scenarios(main_directory, config_name)
+    if scenarios:
+        wanted = set(scenarios)
+        missing = wanted - {os.path.basename(scenario) for scenario in found}
+        if missing:
+            print("Warning! No %s in: %s" % (config_name, ", ".join(sorted(missing))))
+        found = [scenario for scenario in found if os.path.basename(scenario) in wanted]
+    if not found:
+        print("No scenario with %s found in '%s'." % (config_name, main_directory))
+        return 1
+    outputs = [output for output in outputs.split(",") if output]
+    if evaluate:
+        outputs += [output for output in ("tripinfo", "stop") if output not in outputs]
+    command = sumo_command(sumolib.checkBinary("sumo"), config_name, outputs, sumo_args)
+    # longest first, the pool is then never left with a single long scenario at the end
+    found.sort(key=previous_duration, reverse=True)
+    jobs = min(jobs or os.cpu_count() or 1, len(found))
+    print("Running %s scenarios with %s workers." % (len(found), jobs))
+
+    results = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(run_scenario, scenario, command, evaluate, evaluation_output): scenario
+                   for scenario in found}
+        for future in as_completed(futures):
+            name = os.path.basename(futures[future])
+            results[name] = future.result()
+            print("%-24s %s after %.1f s" % (name, "done" if results[name][0] == 0 else
+                                             "FAILED (exit code %s)" % results[name][0], results[name][1]))
+    wall_clock = time.perf_counter() - start
+
+    print("%-24s %10s %6s" % ("scenario", "seconds", "exit"))
+    for name, (returncode, duration) in sorted(results.items()):
+        print("%-24s %10.1f %6s" % (name, duration, returncode))
+    durations = [duration for _, duration in results.values()]
+    print("Wall clock %.1f s, sum of the scenarios %.1f s, longest scenario %.1f s, speedup %.2f." %
+          (wall_clock, sum(durations), max(durations), sum(durations) / wall_clock))
+    failed = sorted(name for name, (returncode, _) in results.items() if returncode != 0)
+    if failed:
+        print("Failed scenarios (see output/%s): %s" % (LOG_FILE, ", ".join(failed)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run all scenarios of a directory as parallel headless SUMO simulations. "
+                    "Unknown arguments are passed on to SUMO.")
+    parser.add_argument("main_directory", nargs="?", default=".",
+                        help="Directory with one subdirectory per scenario (default: the current directory)")
+    parser.add_argument("-s", "--scenarios", help="Comma-separated names of the scenarios to run (default: all)")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of parallel simulations (default: number of cores)")
+    parser.add_argument("--config", default="osm.sumocfg", help="Name of the SUMO config of every scenario")
+    parser.add_argument("--outputs", default=DEFAULT_OUTPUTS,
+                        help="Comma-separated SUMO outputs written to output/ of every scenario, out of %s "
+                             "(default: %s)" % (", ".join(OUTPUTS), DEFAULT_OUTPUTS))
+    parser.add_argument("--evaluate", action="store_true",
+                        help="Evaluate every simulation with parkingSearchTripinfo.py, its results are estimated "
+                             "from the tripinfo and stop output and not comparable with the flow_results.xml of "
+                             "parkingSearchTraffic.py")
+    parser.add_argument("--evaluation-output", default=EVALUATION_OUTPUT,
+                        help="File name in output/ of the --evaluate results (default: %s)" % EVALUATION_OUTPUT)
+    args, sumo_args = parser.parse_known_args()
+    unknown = [output for output in args.outputs.split(",") if output and output not in OUTPUTS]
+    if unknown:
+        parser.error("unknown outputs: %s" % ", ".join(unknown))
+    sys.exit(main(args.main_directory, args.scenarios.split(",") if args.scenarios else None, args.jobs,
+                  args.config, args.outputs, args.evaluate, args.evaluation_output, sumo_args))
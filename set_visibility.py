@@ -1,11 +1,29 @@
 # sets the visibility attribute for the <parkingAreaReroute> elements as described. The script takes a file as a
 # required parameter and has an optional --all-false flag to set all visibility to false.
 # python3 ../../set_visibility.py parking.rerouter.add.xml
+# With --variants the file is left unchanged and read only once to write several variants to separate files:
+# python3 set_visibility.py parking.rerouter.add.xml --variants 0-5,all-true,all-false -o vis_{variant}.add.xml
+# Variants by network distance radius or driver knowledge probability need the network and the parking areas:
+# python3 set_visibility.py parking.rerouter.add.xml --net osm.net.xml --parking-areas parkings.add.xml
+#     --radius 250,500,1000 --probability 0.25,0.5 --decay 500 -o vis_{variant}.add.xml
 
 import xml.etree.ElementTree as ET
 import argparse
+import hashlib
+import math
+import os
 import sys
 
+import numpy as np
+
+HEADER = ('<?xml version=\'1.0\' encoding=\'utf-8\'?>\n'
+          '<additional xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+          'xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/additional_file.xsd">\n')
+# stands in for the visible attribute values when a rerouter is serialized once for all variants
+PLACEHOLDER = '__visible__'
+# part of the key of the cached distance matrices, to be increased whenever compute_distances changes its results
+DISTANCES_VERSION = 2
+
 
 def set_visibility(file, true_count=None, all_false=False, all_true=False):
     """
@@ -63,6 +81,222 @@ def set_visibility(file, true_count=None, all_false=False, all_true=False):
     tree.write(file, encoding='utf-8', xml_declaration=True)
 
 
+def first_visible(true_count):
+    """
+    Returns a visibility rule which sets the first true_count parkingAreaReroute elements of every rerouter to
+    'true' and the others to 'false'. A true_count of None sets all of them to 'true'.
+    """
+    def rule(rerouter_id, parking_area_ids):
+        count = len(parking_area_ids) if true_count is None else true_count
+        return [i < count for i in range(len(parking_area_ids))]
+    return rule
+
+
+def parse_variants(spec):
+    """
+    Parses a comma-separated list of true counts, ranges of true counts ('0-5'), 'all-true' and 'all-false'.
+
+    Returns:
+    list: (name, rule) tuples, the name is used for the {variant} part of the output file names.
+    """
+    variants = []
+    for item in spec.split(','):
+        if item == 'all-true':
+            variants.append(('all_true', first_visible(None)))
+        elif item == 'all-false':
+            variants.append(('all_false', first_visible(0)))
+        else:
+            low, _, high = item.partition('-')
+            for true_count in range(int(low), int(high or low) + 1):
+                variants.append((str(true_count), first_visible(true_count)))
+    return variants
+
+
+def read_rerouter_edges(file):
+    """Streams a rerouter file and returns a dictionary mapping every rerouter ID to the list of its edges."""
+    rerouters = {}
+    context = ET.iterparse(file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'start' and elem.tag == 'rerouter':
+            rerouters[elem.get('id')] = elem.get('edges', '').split()
+        elif event == 'end' and elem.tag == 'rerouter':
+            root.clear()
+    return rerouters
+
+
+def read_parking_positions(file):
+    """Streams a parking area file and returns a dictionary mapping every ID to (edge, startPos, endPos)."""
+    parkings = {}
+    context = ET.iterparse(file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag == 'parkingArea':
+            start = elem.get('startPos')
+            end = elem.get('endPos')
+            parkings[elem.get('id')] = (elem.get('lane').rsplit('_', 1)[0], None if start is None else float(start),
+                                        None if end is None else float(end))
+            root.clear()
+    return parkings
+
+
+def _position(pos, length, default):
+    if pos is None:
+        return default
+    return pos + length if pos < 0 else pos
+
+
+def compute_distances(net, rerouters, parkings, max_distance=math.inf):
+    """
+    Computes the driving distance from every rerouter to every parking area like generateParkingAreaRerouters.py
+    does: from the end of the rerouter's parking area (or the start of its edge if it has none) to the start of
+    the other parking area, the minimum over all edges of the rerouter. The parking area of the rerouter itself
+    has the distance 0.
+
+    Parameters:
+    net (netcache.NetSnapshot): The network.
+    rerouters (dict): The rerouter edges as returned by read_rerouter_edges.
+    parkings (dict): The parking area positions as returned by read_parking_positions.
+    max_distance (float): Larger distances are not searched and stored as unreachable.
+
+    Returns:
+    numpy.ndarray: A float32 array of shape (len(rerouters), len(parkings)), inf where unreachable.
+    """
+    lengths = net.lengths
+    target_edges = np.array([net.index.get(edge, -1) for edge, _, _ in parkings.values()], dtype=np.int64)
+    target_lengths = np.where(target_edges >= 0, lengths[target_edges], 0.)
+    to_pos = np.array([_position(start, length, 0.) for (_, start, _), length in
+                       zip(parkings.values(), target_lengths)])
+    targets = set(target_edges[target_edges >= 0].tolist())
+    in_offsets, in_edges = net.in_offsets, net.in_edges
+    own_columns = {parking_id: i for i, parking_id in enumerate(parkings)}
+    distances = np.full((len(rerouters), len(parkings)), np.inf, dtype=np.float32)
+    for row, (rerouter_id, edges) in enumerate(rerouters.items()):
+        for edge in edges:
+            source = net.index.get(edge)
+            if source is None:
+                continue
+            from_pos = 0.
+            if rerouter_id in parkings and parkings[rerouter_id][0] == edge:
+                from_pos = _position(parkings[rerouter_id][2], lengths[source], lengths[source])
+            predecessors = in_edges[in_offsets[source]:in_offsets[source + 1]].tolist()
+            settled = net.driving_distances(source, max_distance + from_pos, targets | set(predecessors))
+            to_start = np.array([settled.get(e, math.inf) for e in target_edges.tolist()])
+            cost = to_start - from_pos + to_pos
+            # a parking area behind the start position on the same edge is only reached by driving a loop
+            loop = min([settled[p] + lengths[p] for p in predecessors if p in settled], default=math.inf)
+            same = target_edges == source
+            cost[same] = np.where(to_pos[same] >= from_pos, to_pos[same] - from_pos, loop - from_pos + to_pos[same])
+            cost[cost > max_distance] = math.inf
+            np.minimum(distances[row], cost, out=distances[row], casting='unsafe')
+        if rerouter_id in own_columns:
+            distances[row, own_columns[rerouter_id]] = 0.
+    return distances
+
+
+def load_distances(net_file, rerouter_file, parking_file, max_distance=math.inf, cache_dir=None):
+    """
+    Returns the rerouter IDs, the parking area IDs and their distance matrix (see compute_distances). The matrix is
+    cached next to the binary net cache, keyed by the hash of the network and of the rerouters, parking areas and
+    max_distance it was computed for, so it is only computed once for any number of visibility variants.
+    """
+    from netcache import cache_entry, load_snapshot
+    rerouters = read_rerouter_edges(rerouter_file)
+    parkings = read_parking_positions(parking_file)
+    key = hashlib.sha256(repr((DISTANCES_VERSION, sorted(rerouters.items()), sorted(parkings.items()),
+                               max_distance)).encode())
+    cache_file = "%s-visibility-%s.npz" % (cache_entry(net_file, cache_dir), key.hexdigest()[:16])
+    if os.path.isfile(cache_file):
+        with np.load(cache_file) as cached:
+            return cached['rerouter_ids'].tolist(), cached['parking_ids'].tolist(), cached['distances']
+    distances = compute_distances(load_snapshot(net_file, cache_dir), rerouters, parkings, max_distance)
+    rerouter_ids, parking_ids = list(rerouters), list(parkings)
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    with open(cache_file + '.tmp', 'wb') as f:
+        np.savez(f, rerouter_ids=np.array(rerouter_ids, dtype=np.str_),
+                 parking_ids=np.array(parking_ids, dtype=np.str_), distances=distances)
+    os.replace(cache_file + '.tmp', cache_file)
+    return rerouter_ids, parking_ids, distances
+
+
+def distance_visible(rerouter_ids, parking_ids, distances, radius=None, probability=None, decay=None, seed=None):
+    """
+    Returns a visibility rule on a distance matrix: with radius every parking area within that driving distance
+    is visible, with probability each one independently with that probability, scaled by exp(-distance / decay)
+    if decay is given. Unreachable parking areas are never visible, the parking area of the rerouter itself always
+    is (like generateParkingAreaRerouters.py does). The random draws of all rerouters come from one generator seeded
+    with seed and are made in file order, so the result is reproducible.
+    """
+    rows = {rerouter_id: i for i, rerouter_id in enumerate(rerouter_ids)}
+    columns = {parking_id: i for i, parking_id in enumerate(parking_ids)}
+    rng = np.random.default_rng(seed)
+
+    def rule(rerouter_id, parking_area_ids):
+        row = rows.get(rerouter_id)
+        cols = np.array([columns.get(parking_id, -1) for parking_id in parking_area_ids], dtype=np.int64)
+        dist = np.full(len(cols), np.inf)
+        if row is not None:
+            dist[cols >= 0] = distances[row, cols[cols >= 0]]
+        if radius is not None:
+            visible = dist <= radius
+        else:
+            chance = np.where(np.isfinite(dist), probability, 0.)
+            if decay:
+                chance *= np.exp(-np.where(np.isfinite(dist), dist, 0.) / decay)
+            visible = rng.random(len(cols)) < chance
+        visible[[parking_id == rerouter_id for parking_id in parking_area_ids]] = True
+        return visible.tolist()
+    return rule
+
+
+def write_visibility_variants(file, variants):
+    """
+    Streams a rerouter file once and writes one copy per variant with the visibility of its rule. The input is
+    not modified and memory is bounded by a single <rerouter> element.
+
+    Parameters:
+    file (str): The path to the XML file to read.
+    variants (list): (output_file, rule) tuples, rule(rerouter_id, parking_area_ids) returns one bool per
+                     parkingAreaReroute element of the rerouter in document order.
+    """
+    outputs = []
+    try:
+        for output_file, _ in variants:
+            if os.path.dirname(output_file):
+                os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            outputs.append(open(output_file, 'w', encoding='utf-8'))
+            outputs[-1].write(HEADER)
+        context = ET.iterparse(file, events=('start', 'end'))
+        _, root = next(context)
+        depth = 1
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            elem.tail = None
+            parking_area_reroutes = elem.findall('interval/parkingAreaReroute') if elem.tag == 'rerouter' else []
+            for parkingAreaReroute in parking_area_reroutes:
+                parkingAreaReroute.set('visible', PLACEHOLDER)
+            # serialized once, every variant only fills in its values
+            parts = ET.tostring(elem, encoding='unicode').split(PLACEHOLDER)
+            parking_area_ids = [parkingAreaReroute.get('id') for parkingAreaReroute in parking_area_reroutes]
+            for output, (_, rule) in zip(outputs, variants):
+                values = rule(elem.get('id'), parking_area_ids) if parking_area_reroutes else []
+                output.write('    ' + parts[0])
+                for visible, part in zip(values, parts[1:]):
+                    output.write(('true' if visible else 'false') + part)
+                output.write('\n\n')
+            root.clear()
+        for output in outputs:
+            output.write('</additional>\n')
+    finally:
+        for output in outputs:
+            output.close()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Set visibility of parkingAreaReroute elements in XML file.")
     parser.add_argument("file", help="The XML file to modify.")
@@ -70,9 +304,50 @@ if __name__ == "__main__":
                         help="Number of parkingAreaReroute elements to set to true for each rerouter.")
     parser.add_argument("--all-false", action="store_true", help="Set all visibility attributes to false.")
     parser.add_argument("--all-true", action="store_true", help="Set all visibility attributes to true.")
+    parser.add_argument("--variants",
+                        help="Write variants to separate files in one pass instead of modifying the file, e.g. "
+                             "'0-5,all-true,all-false' for every true count from 0 to 5 plus all true and all false.")
+    parser.add_argument("-o", "--output", default="parking.rerouter.{variant}.add.xml",
+                        help="Output file pattern for the variants, {variant} is replaced by the true count, "
+                             "'all_true', 'all_false', 'radius_<r>' or 'probability_<p>'.")
+    parser.add_argument("--net", help="The network for --radius and --probability.")
+    parser.add_argument("--parking-areas", help="The parking area file for --radius and --probability.")
+    parser.add_argument("--radius",
+                        help="Comma-separated driving distances, writes one variant per radius in which all "
+                             "parking areas within it are visible.")
+    parser.add_argument("--probability",
+                        help="Comma-separated probabilities, writes one variant per probability in which each "
+                             "reachable parking area is visible with it.")
+    parser.add_argument("--decay", type=float,
+                        help="Scale the probability with exp(-distance / decay), distance in meters.")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for --probability.")
+    parser.add_argument("--max-distance", type=float, default=math.inf,
+                        help="Parking areas further away are treated as unreachable, bounds the distance search.")
+    parser.add_argument("--net-cache", help="Directory of the net and distance cache (default: .netcache next to "
+                                            "the net).")
 
     args = parser.parse_args()
 
+    if args.variants or args.radius or args.probability:
+        if '{variant}' not in args.output:
+            print("Error: --output must contain {variant}.")
+            sys.exit(1)
+        variants = parse_variants(args.variants) if args.variants else []
+        if args.radius or args.probability:
+            if not args.net or not args.parking_areas:
+                print("Error: --radius and --probability need --net and --parking-areas.")
+                sys.exit(1)
+            matrix = load_distances(args.net, args.file, args.parking_areas, args.max_distance, args.net_cache)
+            for radius in args.radius.split(',') if args.radius else []:
+                variants.append(('radius_' + radius, distance_visible(*matrix, radius=float(radius))))
+            for probability in args.probability.split(',') if args.probability else []:
+                variants.append(('probability_' + probability,
+                                 distance_visible(*matrix, probability=float(probability), decay=args.decay,
+                                                  seed=args.seed)))
+        write_visibility_variants(args.file, [(args.output.replace('{variant}', name), rule)
+                                              for name, rule in variants])
+        sys.exit(0)
+
     # Ensure only one visibility flag is used at a time
     if args.all_false and args.all_true:
         print("Error: --all-false and --all-true cannot be used together.")
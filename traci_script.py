@@ -1,167 +1,886 @@
+import argparse
+import csv
+import hashlib
+import heapq
+import locale
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import sumolib
 import traci
-import locale
+import traci.constants as tc
+
 locale.setlocale(locale.LC_ALL, 'C')
 
-def start_simulation(config_file):
-    # Start the SUMO simulation with the provided config file
-    traci.start(['sumo-gui', '-c', config_file])
+log = logging.getLogger('traci_script')
 
+# The state the controller needs, subscribed once and then delivered with the response to every simulation step
+SIMULATION_VARIABLES = (tc.VAR_TIME, tc.VAR_MIN_EXPECTED_VEHICLES, tc.VAR_DEPARTED_VEHICLES_IDS,
+                        tc.VAR_ARRIVED_VEHICLES_IDS, tc.VAR_PARKING_STARTING_VEHICLES_IDS,
+                        tc.VAR_PARKING_ENDING_VEHICLES_IDS)
+VEHICLE_VARIABLES = (tc.VAR_POSITION, tc.VAR_ROAD_ID, tc.VAR_CO2EMISSION, tc.VAR_DISTANCE)
+LANE_VARIABLES = (tc.LAST_STEP_VEHICLE_ID_LIST,)
 
-def highlight_vehicle(vehicle_id):
-    # Highlight a specific vehicle in the SUMO GUI
-    traci.gui.trackVehicle(traci.gui.getIDList()[0], vehicle_id)
-    traci.gui.setZoom(traci.gui.getIDList()[0], 2000)
+# Headless sumo and sumo-gui are controlled over a TraCI socket, libsumo runs sumo inside this process
+BACKENDS = ('sumo', 'sumo-gui', 'libsumo')
+# The TraCI domains and the functions of the controller timed by the profiler
+PROFILED_DOMAINS = ('simulation', 'vehicle', 'lane', 'edge', 'parkingarea', 'gui')
+PROFILED_FUNCTIONS = ('find_nearest_parking_area', 'park_vehicle')
+# Reads of subscription results are local lookups done once per vehicle and step, they are not wrapped
+UNPROFILED_TRACI = ('getSubscriptionResults', 'getAllSubscriptionResults', 'getContextSubscriptionResults',
+                    'getAllContextSubscriptionResults')
+TRACE_COLUMNS = ('step', 'time', 'vehicles', 'wall_ms', 'simulation_step_ms', 'traci_calls', 'traci_ms',
+                 'control_ms', 'find_nearest_calls', 'park_calls')
 
+# The states of the parking search of a vehicle
+DRIVING = 'driving'
+APPROACHING = 'approaching'
+FOUND_FULL = 'found full'
+REROUTING = 'rerouting'
+PARKED = 'parked'
+# How a search ended besides parking: the vehicle left the simulation, no parking area was left for it, or the
+# simulation ended before it parked
+LEFT = 'left'
+NO_PARKING_AREA = 'no parking area'
+UNFINISHED = 'unfinished'
+# One record per vehicle, the distance is the one driven while searching and retries count the parking areas it
+# found full or could not reach
+METRICS_COLUMNS = ('vehicle_id', 'start_time', 'end_time', 'co2_mg', 'distance_m', 'parking_area', 'retries',
+                   'outcome')
 
-def find_nearest_parking_area(vehicle_pos):
-    # Function to find the nearest parking area to a given position
-    min_distance = float('inf')
-    nearest_parking = None
 
+def start_simulation(config_file, backend='sumo-gui', options=()):
+    # Start the SUMO simulation with the provided config file on the given backend. libsumo has the API of traci,
+    # so the module-level traci is switched to it until close_simulation and the rest of the script works unchanged.
+    global traci
+    if backend == 'libsumo':
+        import libsumo as traci
+    else:
+        import traci
+    binary = sumolib.checkBinary('sumo' if backend == 'libsumo' else backend)
+    traci.start([binary, '-c', config_file] + list(options))
+
+
+def close_simulation():
+    # Closes the simulation and switches the module-level traci back to the TraCI client
+    global traci
+    traci.close()
+    import traci
+
+
+def highlight_vehicle(vehicle_id):
+    # Highlight a specific vehicle in the SUMO GUI, nothing to do without a GUI
+    if not traci.hasGUI():
+        return
     try:
-        parking_area_ids = traci.parkingarea.getIDList()
-    except traci.exceptions.TraCIException as e:
-        print(f"Error getting parking area list: {e}")
-        return None
-
-    for parking_area_id in parking_area_ids:
-        try:
-            lane_id = traci.parkingarea.getLaneID(parking_area_id)
-        except traci.exceptions.TraCIException as e:
-            print(f"Error getting lane ID for parking area {parking_area_id}: {e}")
-            continue
-
-        try:
-            edge_id = traci.lane.getEdgeID(lane_id)
-        except traci.exceptions.TraCIException as e:
-            print(f"Error getting edge ID for lane {lane_id}: {e}")
-            continue
-
-        try:
-            edge_pos = traci.simulation.convert2D(edge_id, pos=0)[0:2]
-        except traci.exceptions.TraCIException as e:
-            print(f"Error converting edge ID {edge_id} to 2D position: {e}")
-            continue
-        except sumolib.geomhelper.SumoException as e:
-            print(f"Error converting edge ID {edge_id} to 2D position: {e}")
-            continue
-
-        try:
-            distance = sumolib.geomhelper.distance(vehicle_pos, edge_pos)
-        except Exception as e:  # sumolib might throw non-TraCI exceptions
-            print(f"Error calculating distance for parking area {parking_area_id}: {e}")
-            continue
-
-        if distance < min_distance:
-            min_distance = distance
-            nearest_parking = parking_area_id
-
-    return nearest_parking
-
-def park_vehicle(vehicle_id):
-    try:
-        vehicle_pos = traci.vehicle.getPosition(vehicle_id)
-        print(f"Vehicle {vehicle_id} position: {vehicle_pos}")
+        traci.gui.trackVehicle(traci.gui.getIDList()[0], vehicle_id)
+        traci.gui.setZoom(traci.gui.getIDList()[0], 2000)
     except traci.exceptions.TraCIException as e:
-        print(f"Error getting position for vehicle {vehicle_id}: {e}")
-        return False
+        log.warning("Error highlighting vehicle %s: %s", vehicle_id, e)
+
+
+# Lanes, edges, positions and capacities of all parking areas, resolved once at startup. The position of a
+# parking area is the start of its edge, the positions are kept in a NumPy array and a 2-d tree over them, so
+# nearest and k-nearest queries take O(log N) without any TraCI call.
+class ParkingAreaIndex:
+    def __init__(self, ids, lanes, edges, positions, capacities):
+        self.ids = list(ids)
+        self.lanes = list(lanes)
+        self.edges = list(edges)
+        self.positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.capacities = np.asarray(capacities, dtype=np.int64)
+        self.index = {parking_area_id: i for i, parking_area_id in enumerate(self.ids)}
+        self._coords = self.positions.tolist()
+        self._tree = self._build(np.arange(len(self.ids)), 0)
+
+    @classmethod
+    def from_traci(cls, parking_capacities):
+        # Asks the running simulation once for every parking area, the capacities (parking area ID -> capacity)
+        # come from the additional files as TraCI only has a deprecated getter for them
+        ids, lanes, edges, positions, capacities = [], [], [], [], []
+        for parking_area_id in traci.parkingarea.getIDList():
+            capacity = parking_capacities.get(parking_area_id)
+            if capacity is None:
+                log.warning("Error resolving parking area %s: not in the additional files", parking_area_id)
+                continue
+            try:
+                lane_id = traci.parkingarea.getLaneID(parking_area_id)
+                edge_id = traci.lane.getEdgeID(lane_id)
+                edge_pos = traci.simulation.convert2D(edge_id, pos=0)[0:2]
+            except traci.exceptions.TraCIException as e:
+                log.warning("Error resolving parking area %s: %s", parking_area_id, e)
+                continue
+            ids.append(parking_area_id)
+            lanes.append(lane_id)
+            edges.append(edge_id)
+            positions.append(edge_pos)
+            capacities.append(capacity)
+        return cls(ids, lanes, edges, positions, capacities)
+
+    def _build(self, indices, depth):
+        # Nodes are (index, axis, left, right) tuples split at the median of alternating axes
+        if len(indices) == 0:
+            return None
+        axis = depth % 2
+        indices = indices[np.argsort(self.positions[indices, axis], kind='stable')]
+        middle = len(indices) // 2
+        return (int(indices[middle]), axis,
+                self._build(indices[:middle], depth + 1), self._build(indices[middle + 1:], depth + 1))
+
+    def nearest(self, pos, k=1, occupancy=None, exclude=()):
+        # Returns the IDs of the k parking areas nearest to pos, closest first. With occupancy (the number of
+        # parked vehicles per parking area in index order) only areas with free capacity count, areas in exclude
+        # are skipped. Equally distant areas come in the order of the index like the former linear scan.
+        x, y = pos[0], pos[1]
+        coords, capacities = self._coords, self.capacities
+        excluded = {self.index[parking_area_id] for parking_area_id in exclude if parking_area_id in self.index}
+        heap = []  # the best k as (-squared distance, -index), the worst on top
+
+        def visit(node):
+            if node is None:
+                return
+            i, axis, left, right = node
+            diff = (x, y)[axis] - coords[i][axis]
+            visit(left if diff < 0 else right)
+            if i not in excluded and (occupancy is None or occupancy[i] < capacities[i]):
+                dx, dy = x - coords[i][0], y - coords[i][1]
+                entry = (-(dx * dx + dy * dy), -i)
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+            if len(heap) < k or diff * diff <= -heap[0][0]:
+                visit(right if diff < 0 else left)
+
+        visit(self._tree)
+        return [self.ids[-i] for _, i in sorted(heap, reverse=True)]
+
+
+def read_config_files(config_file):
+    # Returns the net file and the additional files of a SUMO configuration, relative to the working directory
+    directory = os.path.dirname(config_file)
+    net_files = [os.path.join(directory, net.value)
+                 for net in sumolib.xml.parse_fast(config_file, 'net-file', ['value'])]
+    additional_files = [os.path.join(directory, name.strip())
+                        for additional in sumolib.xml.parse_fast(config_file, 'additional-files', ['value'])
+                        for name in additional.value.split(',')]
+    return net_files[0] if net_files else None, additional_files
+
+
+def parking_capacity(parking_area):
+    # The roadside capacity plus the explicitly placed spaces of a parsed parkingArea element
+    spaces = parking_area.space if parking_area.hasChild('space') else []
+    return int(parking_area.getAttributeSecure('roadsideCapacity', 0)) + len(spaces)
+
+
+def read_parking_capacities(additional_files):
+    # Returns the capacity of every parking area in the given additional files
+    return {parking_area.id: parking_capacity(parking_area) for additional_file in additional_files
+            for parking_area in sumolib.xml.parse(additional_file, 'parkingArea')}
+
+
+def read_rerouter_edges(additional_files):
+    # Returns the edges of all rerouters in the given additional files
+    return sorted({edge for additional_file in additional_files
+                   for rerouter in sumolib.xml.parse_fast(additional_file, 'rerouter', ['id', 'edges'])
+                   for edge in rerouter.edges.split()})
+
+
+# Routes from a fixed set of source edges (the rerouter and parking area edges) to every parking area edge. They
+# are searched once per network with free-flow travel times and cached next to the binary net cache, so a searching
+# vehicle gets its route by a lookup and setRoute instead of a route search in SUMO. The routes of every pair are
+# stored as one CSR array of edge indices. refresh() compares the routes with current travel times and searches
+# the routes of a source again only when the cost of one of them moved by more than the threshold.
+class RouteTable:
+    def __init__(self, net, sources, targets, offsets=None, edges=None, costs=None, threshold=0.2):
+        self.net = net
+        self.sources = list(sources)
+        self.targets = list(targets)
+        self.source_index = {edge_id: i for i, edge_id in enumerate(self.sources)}
+        self.target_index = {edge_id: i for i, edge_id in enumerate(self.targets)}
+        self.threshold = threshold
+        self.edge_ids = net.edge_ids.tolist()
+        self.weights = net.lengths / np.maximum(net.speeds, 0.1)
+        out_offsets, out_edges = net.out_offsets.tolist(), net.out_edges.tolist()
+        self._successors = [out_edges[out_offsets[e]:out_offsets[e + 1]] for e in range(len(self.edge_ids))]
+        self._passenger = net.passenger.tolist()
+        self._target_edges = [net.index[edge_id] for edge_id in self.targets]
+        if offsets is None:
+            routes = [route for source in self.sources for route in self._search(net.index[source])]
+            self._store(routes)
+        else:
+            self.offsets, self.edges, self.costs = offsets, edges, costs
+
+    @classmethod
+    def load(cls, net_file, sources, targets, cache_dir=None, threshold=0.2):
+        # Returns the route table of the network, from the cache if it was already searched for these edges
+        from netcache import cache_entry, load_snapshot
+        sources, targets = sorted(set(sources)), sorted(set(targets))
+        net = load_snapshot(net_file, cache_dir)
+        unknown = [edge_id for edge_id in sources + targets if edge_id not in net.index]
+        if unknown:
+            log.warning("Ignoring edges missing in the network: %s", ', '.join(unknown))
+            sources = [edge_id for edge_id in sources if edge_id in net.index]
+            targets = [edge_id for edge_id in targets if edge_id in net.index]
+        key = hashlib.sha256(repr((sources, targets)).encode())
+        cache_file = "%s-routes-%s.npz" % (cache_entry(net_file, cache_dir), key.hexdigest()[:16])
+        if os.path.isfile(cache_file):
+            with np.load(cache_file) as cached:
+                return cls(net, sources, targets, cached['offsets'], cached['edges'], cached['costs'], threshold)
+        table = cls(net, sources, targets, threshold=threshold)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file + '.tmp', 'wb') as f:
+            np.savez(f, offsets=table.offsets, edges=table.edges, costs=table.costs)
+        os.replace(cache_file + '.tmp', cache_file)
+        return table
+
+    def _search(self, source):
+        # Dijkstra on the travel times for passenger cars from the source edge, returns the route to every target
+        # (empty if it cannot be reached)
+        successors, passenger, weights = self._successors, self._passenger, self.weights.tolist()
+        remaining = set(self._target_edges)
+        best = {source: 0.}
+        previous = {}
+        settled = set()
+        heap = [(0., source)]
+        while heap and remaining:
+            cost, edge = heapq.heappop(heap)
+            if edge in settled:
+                continue
+            settled.add(edge)
+            remaining.discard(edge)
+            next_cost = cost + weights[edge]
+            for succ in successors[edge]:
+                if passenger[succ] and next_cost < best.get(succ, math.inf):
+                    best[succ] = next_cost
+                    previous[succ] = edge
+                    heapq.heappush(heap, (next_cost, succ))
+        routes = []
+        for target in self._target_edges:
+            route = []
+            if target in settled:
+                edge = target
+                while edge != source:
+                    route.append(edge)
+                    edge = previous[edge]
+                route.append(source)
+                route.reverse()
+            routes.append(route)
+        return routes
+
+    def _store(self, routes):
+        self.offsets = np.zeros(len(routes) + 1, dtype=np.int64)
+        np.cumsum([len(route) for route in routes], out=self.offsets[1:])
+        self.edges = np.array([edge for route in routes for edge in route], dtype=np.int32)
+        self.costs = self._route_costs()
+
+    def _route_costs(self):
+        # The sum of the weights over every route, unreachable pairs cost nothing
+        counts = np.diff(self.offsets)
+        costs = np.zeros(len(counts))
+        np.add.at(costs, np.repeat(np.arange(len(counts)), counts), self.weights[self.edges])
+        return costs.reshape(len(self.sources), len(self.targets))
+
+    def route(self, from_edge, to_edge):
+        # Returns the edge IDs of the route or None if the pair is not in the table or cannot be reached
+        source, target = self.source_index.get(from_edge), self.target_index.get(to_edge)
+        if source is None or target is None:
+            return None
+        pair = source * len(self.targets) + target
+        edges = self.edges[self.offsets[pair]:self.offsets[pair + 1]]
+        return [self.edge_ids[edge] for edge in edges.tolist()] if len(edges) else None
+
+    def used_edges(self):
+        return np.unique(self.edges)
+
+    def refresh(self, edges, travel_times):
+        # Takes the current travel times of the given edges and searches the routes of all sources again where the
+        # cost of a route changed by more than the threshold, returns the number of sources searched again
+        self.weights[edges] = travel_times
+        costs = self._route_costs()
+        changed = np.abs(costs - self.costs) > self.threshold * np.maximum(self.costs, 1e-9)
+        stale = np.flatnonzero(changed.any(axis=1)).tolist()
+        if stale:
+            routes = [self.edges[self.offsets[pair]:self.offsets[pair + 1]].tolist()
+                      for pair in range(len(self.offsets) - 1)]
+            for source in stale:
+                pair = source * len(self.targets)
+                routes[pair:pair + len(self.targets)] = self._search(self.net.index[self.sources[source]])
+            self._store(routes)
+        return len(stale)
+
+
+def refresh_routes(routes):
+    # Asks SUMO for the current travel times of the edges on the table routes and refreshes the table
+    edges = routes.used_edges()
+    travel_times = [traci.edge.getTraveltime(routes.edge_ids[edge]) for edge in edges.tolist()]
+    return routes.refresh(edges, travel_times)
+
+
+# Counts the TraCI round trips, every command sent to SUMO is one, to compare the calls per simulation step.
+# libsumo has no round trips, the count stays 0. The count hooks into the private send method of the connection,
+# with a TraCI release which does not have it calls is None and the count is reported as n/a.
+class RoundTripCounter:
+    def __init__(self):
+        self.calls = 0
+        self.steps = 0
+        if traci.isLibsumo():
+            return
+        connection = traci.getConnection()
+        send = getattr(connection, '_sendExact', None)
+        if send is None:
+            self.calls = None
+            return
+
+        def counting_send():
+            self.calls += 1
+            return send()
+        connection._sendExact = counting_send
+
+    def per_step(self):
+        if self.calls is None:
+            return None
+        return self.calls / self.steps if self.steps else 0.
+
+    def summary(self):
+        if self.calls is None:
+            return f"TraCI round trips: n/a in {self.steps} steps"
+        return f"TraCI round trips: {self.calls} in {self.steps} steps, {self.per_step():.2f} per step"
+
+
+def subscribe(parking_index):
+    # Subscribes the simulation state and the vehicles on the parking area lanes, vehicles follow as they depart
+    traci.simulation.subscribe(SIMULATION_VARIABLES)
+    for lane_id in set(parking_index.lanes):
+        traci.lane.subscribe(lane_id, LANE_VARIABLES)
+
+
+def simulation_step():
+    # Advances the simulation by one step, subscribes the vehicles which departed in it and returns their IDs
+    traci.simulationStep()
+    departed = traci.simulation.getSubscriptionResults()[tc.VAR_DEPARTED_VEHICLES_IDS]
+    for vehicle_id in departed:
+        traci.vehicle.subscribe(vehicle_id, VEHICLE_VARIABLES)
+    return departed
+
+
+# Occupancy of the parking areas, kept locally from the parking start and end events of every step. Only a vehicle
+# which starts to park costs a TraCI call, to look up its parking area. The capacities come from the index.
+class ParkingOccupancy:
+    def __init__(self, parking_index):
+        self.parking_index = parking_index
+        self.counts = np.zeros(len(parking_index.ids), dtype=np.int64)
+        # vehicle ID -> index of the parking area it is parked in
+        self.parked = {}
+
+    def update(self, starting, ending):
+        for vehicle_id in ending:
+            i = self.parked.pop(vehicle_id, None)
+            if i is not None:
+                self.counts[i] -= 1
+        for vehicle_id in starting:
+            stops = traci.vehicle.getStops(vehicle_id, 1)
+            i = self.parking_index.index.get(stops[0].stoppingPlaceID) if stops else None
+            if i is not None:
+                self.counts[i] += 1
+                self.parked[vehicle_id] = i
 
+    def free(self, parking_area_id):
+        i = self.parking_index.index[parking_area_id]
+        return int(self.parking_index.capacities[i] - self.counts[i])
+
+    def most_free(self, pos, k, exclude=()):
+        # The parking area with the most free spaces among the k nearest ones with a free space, the nearer one
+        # of equally free areas
+        candidates = self.parking_index.nearest(pos, k, self.counts, exclude)
+        return max(candidates, key=self.free) if candidates else None
+
+
+def find_nearest_parking_area(vehicle_pos, parking_index, occupancy=None, exclude=()):
+    # Function to find the nearest parking area to a given position, answered by the index without TraCI calls
+    nearest = parking_index.nearest(vehicle_pos, 1, occupancy, exclude)
+    return nearest[0] if nearest else None
+
+
+def park_vehicle(vehicle_id, parking_area_id, occupancy):
+    # Stops the vehicle at the parking area if it has a free space, returns whether the stop was set
+    if occupancy.free(parking_area_id) <= 0:
+        return False
     try:
-        nearest_parking = find_nearest_parking_area(vehicle_pos)
+        traci.vehicle.setParkingAreaStop(vehicle_id, parking_area_id, duration=60)
     except traci.exceptions.TraCIException as e:
-        print(f"Error finding nearest parking area for vehicle {vehicle_id}: {e}")
+        log.warning("Error setting parking area stop for vehicle %s at parking area %s: %s", vehicle_id,
+                    parking_area_id, e)
         return False
+    return True
 
-    if nearest_parking:
-        try:
-            lane_id = traci.parkingarea.getLaneID(nearest_parking)
-            edge_id = traci.lane.getEdgeID(lane_id)
-            traci.vehicle.changeTarget(vehicle_id, edge_id)
-        except traci.exceptions.TraCIException as e:
-            print(f"Error changing target for vehicle {vehicle_id} to parking area {nearest_parking}: {e}")
-            return False
-
-        try:
-            while True:
-                traci.simulationStep()
-                current_lane_id = traci.vehicle.getLaneID(vehicle_id)
-                if current_lane_id == lane_id:
-                    vehicle_count = traci.parkingarea.getVehicleCount(nearest_parking)
-                    capacity = traci.parkingarea.getCapacity(nearest_parking)
-                    if vehicle_count < capacity:
-                        try:
-                            traci.vehicle.setParkingAreaStop(vehicle_id, nearest_parking, duration=60)
-                        except traci.exceptions.TraCIException as e:
-                            print(f"Error setting parking area stop for vehicle {vehicle_id} at parking area {nearest_parking}: {e}")
-                            return False
-                        return True
-                    else:
-                        try:
-                            nearest_parking = find_nearest_parking_area(traci.vehicle.getPosition(vehicle_id))
-                        except traci.exceptions.TraCIException as e:
-                            print(f"Error finding next nearest parking area for vehicle {vehicle_id}: {e}")
-                            return False
-
-                        if nearest_parking:
-                            try:
-                                lane_id = traci.parkingarea.getLaneID(nearest_parking)
-                                edge_id = traci.lane.getEdgeID(lane_id)
-                                traci.vehicle.changeTarget(vehicle_id, edge_id)
-                            except traci.exceptions.TraCIException as e:
-                                print(f"Error changing target for vehicle {vehicle_id} to next nearest parking area {nearest_parking}: {e}")
-                                return False
-                        else:
-                            return False
-        except traci.exceptions.TraCIException as e:
-            print(f"Error during simulation step for vehicle {vehicle_id}: {e}")
-            return False
-
-    return False
-
-
-def main():
-    config_file = 'osm.sumocfg'
-    start_simulation(config_file)
-
-    tracked_vehicle = 'veh0'  # Change this to your target vehicle ID
-    highlight_vehicle(tracked_vehicle)
 
-    vehicle_data = {}
-
-    while traci.simulation.getMinExpectedNumber() > 0:
-        traci.simulationStep()
-
-        vehicle_ids = traci.vehicle.getIDList()
-        for vehicle_id in vehicle_ids:
-            if vehicle_id not in vehicle_data:
-                vehicle_data[vehicle_id] = {
-                    'start_time': traci.simulation.getTime(),
-                    'co2': 0,
-                    'distance': 0
-                }
-
-            if park_vehicle(vehicle_id):
-                end_time = traci.simulation.getTime()
-                trip_time = end_time - vehicle_data[vehicle_id]['start_time']
-                average_speed = traci.vehicle.getDistance(
-                    vehicle_id) / trip_time
-                co2_consumption = vehicle_data[vehicle_id]['co2']
-
-                print(f"Vehicle {vehicle_id} parked")
-                print(f"Trip time: {trip_time} seconds")
-                print(f"Average speed: {average_speed} m/s")
-                print(f"CO2 consumption: {co2_consumption} mg")
-
-                del vehicle_data[vehicle_id]
+# The parking search of one vehicle
+class ParkingSearch:
+    __slots__ = ('vehicle_id', 'state', 'parking_area', 'full_parkings', 'start_time', 'co2', 'start_distance',
+                 'distance')
+
+    def __init__(self, vehicle_id, start_time, start_distance=0.):
+        self.vehicle_id = vehicle_id
+        self.state = DRIVING
+        self.parking_area = None
+        # parking areas found full (or missed) by this vehicle, they are not tried again
+        self.full_parkings = set()
+        self.start_time = start_time
+        self.co2 = 0
+        # the odometer (VAR_DISTANCE) of the vehicle when the search started and when it was last seen driving
+        self.start_distance = start_distance
+        self.distance = start_distance
+
+
+# Writes one METRICS_COLUMNS record per finished vehicle to a CSV file. The records are buffered as row tuples
+# and appended in batches of batch_size vehicles, so the step loop neither writes per vehicle nor keeps the
+# vehicles which are done.
+class MetricsSink:
+    def __init__(self, path, batch_size=1000):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(METRICS_COLUMNS)
+        self.batch_size = batch_size
+        self.rows = []
+        self.records = 0
+
+    def add(self, search, end_time, outcome):
+        parking_area = search.parking_area if outcome == PARKED else ''
+        self.rows.append((search.vehicle_id, search.start_time, end_time, round(search.co2, 3),
+                          round(search.distance - search.start_distance, 3), parking_area,
+                          len(search.full_parkings), outcome))
+        self.records += 1
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self._writer.writerows(self.rows)
+        self._file.flush()
+        self.rows.clear()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+# Advances the parking search of all vehicles inside the global step loop. Only vehicles with an event in a step
+# are touched: departures and arrivals come with the simulation subscription, and reaching the lane of the target
+# parking area shows in the subscribed vehicle list of that lane, which is only looked at while vehicles approach
+# a parking area on it. Vehicles head for the nearest parking area with a free space, or with candidates > 1 for
+# the one with the most free spaces among that many nearest areas. With a route table the routes to the parking
+# areas are looked up and set, SUMO only searches routes from edges which are not in the table. A search is dropped
+# as soon as it ends, its record goes to the metrics sink if there is one.
+class ParkingController:
+    def __init__(self, parking_index, candidates=1, routes=None, refresh_interval=300, metrics=None):
+        self.parking_index = parking_index
+        self.occupancy = ParkingOccupancy(parking_index)
+        self.candidates = candidates
+        self.routes = routes
+        self.refresh_interval = refresh_interval
+        self.metrics = metrics
+        # the number of routes set from the table and searched by SUMO
+        self.table_routes = 0
+        self.searched_routes = 0
+        self.searches = {}
+        # lane ID -> IDs of the vehicles approaching a parking area on it
+        self.approaching = {}
+
+    def depart(self, vehicle_id, now):
+        vehicle_state = traci.vehicle.getSubscriptionResults(vehicle_id)
+        search = ParkingSearch(vehicle_id, now, vehicle_state[tc.VAR_DISTANCE])
+        self.searches[vehicle_id] = search
+        vehicle_pos = vehicle_state[tc.VAR_POSITION]
+        log.debug("Vehicle %s position: %s", vehicle_id, vehicle_pos)
+        self._head_for(search, self._choose(vehicle_pos, search.full_parkings), now)
+
+    def arrive(self, vehicle_id, now):
+        search = self.searches.pop(vehicle_id, None)
+        if search is not None:
+            log.info("Vehicle %s left the simulation before parking", vehicle_id)
+            if search.state == APPROACHING:
+                self._leave_lane(search)
+            self._finish(search, now, LEFT)
+
+    def finish(self):
+        # Records the vehicles still searching when the simulation ends
+        for search in self.searches.values():
+            self._finish(search, None, UNFINISHED)
+        self.searches.clear()
+        self.approaching.clear()
+
+    def update(self, now):
+        # Handles the vehicles which reached the lane of their parking area and returns the searches which ended
+        # with parking in this step
+        parked = []
+        for lane_id, vehicle_ids in list(self.approaching.items()):
+            arrived = vehicle_ids.intersection(traci.lane.getSubscriptionResults(lane_id)[tc.LAST_STEP_VEHICLE_ID_LIST])
+            for vehicle_id in arrived:
+                search = self.searches[vehicle_id]
+                self._leave_lane(search)
+                vehicle_state = traci.vehicle.getSubscriptionResults(vehicle_id)
+                if park_vehicle(vehicle_id, search.parking_area, self.occupancy):
+                    search.state = PARKED
+                    search.distance = vehicle_state[tc.VAR_DISTANCE]
+                    del self.searches[vehicle_id]
+                    self._finish(search, now, PARKED)
+                    parked.append(search)
+                else:
+                    search.state = FOUND_FULL
+                    search.full_parkings.add(search.parking_area)
+                    self._head_for(search, self._choose(vehicle_state[tc.VAR_POSITION], search.full_parkings), now)
+        return parked
+
+    def accumulate(self):
+        # Adds the subscribed emissions of this step to the searching vehicles and keeps their odometer, which is
+        # cumulative and only taken over. Vehicles off the road (e.g. stopped in a parking area) report invalid values.
+        # The results of all subscribed vehicles are fetched at once instead of one call per searching vehicle.
+        vehicle_states = traci.vehicle.getAllSubscriptionResults()
+        for vehicle_id, search in self.searches.items():
+            vehicle_state = vehicle_states[vehicle_id]
+            if vehicle_state[tc.VAR_CO2EMISSION] != tc.INVALID_DOUBLE_VALUE:
+                search.co2 += vehicle_state[tc.VAR_CO2EMISSION]
+                search.distance = vehicle_state[tc.VAR_DISTANCE]
+
+    def _choose(self, vehicle_pos, exclude):
+        if self.candidates > 1:
+            return self.occupancy.most_free(vehicle_pos, self.candidates, exclude)
+        return find_nearest_parking_area(vehicle_pos, self.parking_index, self.occupancy.counts, exclude)
+
+    def _head_for(self, search, parking_area_id, now):
+        # Sends the vehicle to the parking area, or to the next nearest one while the target cannot be reached
+        vehicle_id = search.vehicle_id
+        search.state = REROUTING
+        while parking_area_id is not None:
+            i = self.parking_index.index[parking_area_id]
+            try:
+                self._set_route(vehicle_id, self.parking_index.edges[i])
+            except traci.exceptions.TraCIException as e:
+                log.warning("Error changing target for vehicle %s to parking area %s: %s", vehicle_id,
+                            parking_area_id, e)
+                search.full_parkings.add(parking_area_id)
+                vehicle_pos = traci.vehicle.getSubscriptionResults(vehicle_id)[tc.VAR_POSITION]
+                parking_area_id = self._choose(vehicle_pos, search.full_parkings)
+                continue
+            search.state = APPROACHING
+            search.parking_area = parking_area_id
+            self.approaching.setdefault(self.parking_index.lanes[i], set()).add(vehicle_id)
+            return
+        log.warning("No parking area left for vehicle %s", vehicle_id)
+        del self.searches[vehicle_id]
+        self._finish(search, now, NO_PARKING_AREA)
+
+    def _finish(self, search, now, outcome):
+        if self.metrics is not None:
+            self.metrics.add(search, now, outcome)
+
+    def _set_route(self, vehicle_id, edge_id):
+        if self.routes is not None:
+            route = self.routes.route(traci.vehicle.getSubscriptionResults(vehicle_id)[tc.VAR_ROAD_ID], edge_id)
+            if route:
+                try:
+                    traci.vehicle.setRoute(vehicle_id, route)
+                    self.table_routes += 1
+                    return
+                except traci.exceptions.TraCIException:
+                    pass
+        traci.vehicle.changeTarget(vehicle_id, edge_id)
+        self.searched_routes += 1
+
+    def _leave_lane(self, search):
+        lane_id = self.parking_index.lanes[self.parking_index.index[search.parking_area]]
+        vehicle_ids = self.approaching[lane_id]
+        vehicle_ids.discard(search.vehicle_id)
+        if not vehicle_ids:
+            del self.approaching[lane_id]
+
+
+# Counts the calls and the time of every function of the TraCI domains and of the profiled controller functions,
+# per run and per simulation step. The functions are replaced by thin timing wrappers while the profiler is
+# installed, so the overhead is two clock reads per call. simulationStep is the time SUMO needs for the step
+# (including the transfer of the subscription results), the other TraCI calls are round trips (or in-process calls
+# with libsumo) and the rest of the step is Python control logic, which includes the reads of subscription results.
+# Every step is written as one row of a CSV trace.
+class Profiler:
+    def __init__(self, trace_file=None):
+        # function name -> [calls, seconds]
+        self.functions = {}
+        self._originals = []
+        self._trace_file = open(trace_file, 'w', newline='') if trace_file else None
+        self._trace = csv.writer(self._trace_file) if trace_file else None
+        if self._trace is not None:
+            self._trace.writerow(TRACE_COLUMNS)
+        self.steps = 0
+        self.wall = self.simulation_step = self.traci = 0.
+        self.traci_calls = 0
+        # TraCI functions call each other (vehicle.setParkingAreaStop calls vehicle.setStop), only the outermost
+        # call counts for the TraCI totals
+        self._traci_depth = 0
+        self._step_start = None
+        # the totals at the end of the previous step
+        self._previous = (0., 0., 0, 0, 0)
+
+    def install(self):
+        # Wraps the domains of the current backend, which start_simulation selected, and the controller functions
+        self._wrap(traci, 'simulationStep', 'simulationStep', 'simulation_step')
+        for domain in PROFILED_DOMAINS:
+            obj = getattr(traci, domain, None)
+            for name in dir(obj) if obj is not None else ():
+                function = getattr(obj, name)
+                if (not name.startswith('_') and name not in UNPROFILED_TRACI and callable(function)
+                        and not isinstance(function, type)):
+                    self._wrap(obj, name, f'{domain}.{name}', 'traci')
+        module = globals()
+        for name in PROFILED_FUNCTIONS:
+            self._wrap(module, name, name, None)
+        self._step_start = time.perf_counter()
+
+    def uninstall(self):
+        for obj, name, original in reversed(self._originals):
+            if isinstance(obj, dict):
+                obj[name] = original
             else:
-                vehicle_data[vehicle_id]['co2'] += traci.vehicle.getCO2Emission(
-                    vehicle_id)
-                vehicle_data[vehicle_id]['distance'] += traci.vehicle.getDistance(
-                    vehicle_id)
+                setattr(obj, name, original)
+        self._originals = []
 
-    traci.close()
+    def _wrap(self, obj, name, label, category):
+        original = obj[name] if isinstance(obj, dict) else getattr(obj, name)
+        stats = self.functions.setdefault(label, [0, 0.])
+        perf_counter = time.perf_counter
+        is_traci = category == 'traci'
+
+        def wrapper(*args, **kwargs):
+            if is_traci:
+                self._traci_depth += 1
+            start = perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                stats[0] += 1
+                stats[1] += elapsed
+                if is_traci:
+                    self._traci_depth -= 1
+                    if not self._traci_depth:
+                        self.traci_calls += 1
+                        self.traci += elapsed
+                elif category == 'simulation_step':
+                    self.simulation_step += elapsed
+        self._originals.append((obj, name, original))
+        if isinstance(obj, dict):
+            obj[name] = wrapper
+        else:
+            setattr(obj, name, wrapper)
+
+    def end_step(self, now, vehicles):
+        # Closes the current step and writes its trace row
+        end = time.perf_counter()
+        wall = end - self._step_start
+        self._step_start = end
+        self.steps += 1
+        self.wall += wall
+        if self._trace is not None:
+            previous = self._previous
+            simulation_step = self.simulation_step - previous[0]
+            traci_time = self.traci - previous[1]
+            find_nearest, park = (self.functions[name][0] for name in PROFILED_FUNCTIONS)
+            self._trace.writerow((self.steps, now, vehicles, round(wall * 1e3, 3), round(simulation_step * 1e3, 3),
+                                  self.traci_calls - previous[2], round(traci_time * 1e3, 3),
+                                  round((wall - simulation_step - traci_time) * 1e3, 3),
+                                  find_nearest - previous[3], park - previous[4]))
+            self._previous = (self.simulation_step, self.traci, self.traci_calls, find_nearest, park)
+
+    def close(self):
+        self.uninstall()
+        if self._trace_file is not None:
+            self._trace_file.close()
+
+    def summary(self):
+        control = self.wall - self.simulation_step - self.traci
+        lines = [f"Profile of {self.steps} steps in {self.wall:.2f} s",
+                 f"  simulationStep   {self.simulation_step:9.2f} s {self._share(self.simulation_step):6.1f}%",
+                 f"  other TraCI      {self.traci:9.2f} s {self._share(self.traci):6.1f}% in {self.traci_calls} calls",
+                 f"  Python control   {control:9.2f} s {self._share(control):6.1f}%",
+                 f"{'function':40} {'calls':>10} {'seconds':>10} {'mean us':>10}"]
+        for label, (calls, seconds) in sorted(self.functions.items(), key=lambda item: -item[1][1]):
+            if calls:
+                lines.append(f"{label:40} {calls:10d} {seconds:10.3f} {seconds / calls * 1e6:10.1f}")
+        return '\n'.join(lines)
+
+    def _share(self, seconds):
+        return 100. * seconds / self.wall if self.wall else 0.
+
+
+def run(controller, max_steps=None, profiler=None):
+    # The global step loop until all vehicles are done or max_steps are simulated. Returns the number of steps and
+    # the sum of the vehicles in the simulation over all steps.
+    steps = vehicle_steps = running = 0
+    simulation_state = traci.simulation.getSubscriptionResults()
+    debug = log.isEnabledFor(logging.DEBUG)
+    while simulation_state[tc.VAR_MIN_EXPECTED_VEHICLES] > 0 and (max_steps is None or steps < max_steps):
+        departed = simulation_step()
+        simulation_state = traci.simulation.getSubscriptionResults()
+        now = simulation_state[tc.VAR_TIME]
+        arrived = simulation_state[tc.VAR_ARRIVED_VEHICLES_IDS]
+        steps += 1
+        running += len(departed) - len(arrived)
+        vehicle_steps += running
+
+        if controller.routes is not None and steps % controller.refresh_interval == 0:
+            refresh_routes(controller.routes)
+        controller.occupancy.update(simulation_state[tc.VAR_PARKING_STARTING_VEHICLES_IDS],
+                                    simulation_state[tc.VAR_PARKING_ENDING_VEHICLES_IDS])
+        for vehicle_id in arrived:
+            controller.arrive(vehicle_id, now)
+        for vehicle_id in departed:
+            controller.depart(vehicle_id, now)
+        for search in controller.update(now):
+            traci.vehicle.unsubscribe(search.vehicle_id)
+            if debug:
+                trip_time = now - search.start_time
+                distance = search.distance - search.start_distance
+                log.debug("Vehicle %s parked after %s s and %.1f m (%.2f m/s), CO2 consumption %.1f mg",
+                          search.vehicle_id, trip_time, distance, distance / trip_time if trip_time else 0.,
+                          search.co2)
+        controller.accumulate()
+        if profiler is not None:
+            profiler.end_step(now, running)
+    return steps, vehicle_steps
+
+
+def start_controller(config_file, backend, options=(), candidates=1, route_table=False, refresh_interval=300,
+                     threshold=0.2, net_cache=None, metrics=None):
+    # Starts the simulation and the parking controller on it, with route_table the routes from the rerouter and
+    # parking area edges of the scenario to the parking areas are looked up
+    start_simulation(config_file, backend, options)
+    round_trips = RoundTripCounter()
+    net_file, additional_files = read_config_files(config_file)
+    # resolved once at the start, afterwards nearest parking area queries need no TraCI calls
+    parking_index = ParkingAreaIndex.from_traci(read_parking_capacities(additional_files))
+    subscribe(parking_index)
+    routes = None
+    if route_table:
+        sources = read_rerouter_edges(additional_files) + parking_index.edges
+        routes = RouteTable.load(net_file, sources, parking_index.edges, net_cache, threshold)
+    return ParkingController(parking_index, candidates, routes, refresh_interval, metrics), round_trips
+
+
+def _benchmark_backend(config_file, backend, max_steps, profile=False, **settings):
+    # Runs the controller for max_steps on one backend and returns the steps, seconds, vehicle steps and round trips
+    controller, round_trips = start_controller(config_file, backend, ['--no-step-log', '--duration-log.disable'],
+                                               **settings)
+    profiler = Profiler() if profile else None
+    if profiler is not None:
+        profiler.install()
+    start = time.perf_counter()
+    steps, vehicle_steps = run(controller, max_steps, profiler)
+    elapsed = time.perf_counter() - start
+    if profiler is not None:
+        profiler.close()
+        print(f"{backend}: {profiler.summary()}", flush=True)
+    close_simulation()
+    return backend, steps, elapsed, vehicle_steps, round_trips.calls
+
+
+def _init_benchmark_worker(log_level):
+    logging.basicConfig(level=log_level, format='%(message)s')
+
+
+def benchmark(config_file, backends, max_steps, profile=False, **settings):
+    # Runs the controller for max_steps on every backend and reports the simulated steps and vehicles per second.
+    # Every backend runs in a fresh process: importing libsumo replaces the TraCI exception classes of traci, so a
+    # socket backend after libsumo in the same process would not catch its own errors.
+    results = []
+    for backend in backends:
+        with ProcessPoolExecutor(1, multiprocessing.get_context('spawn'), initializer=_init_benchmark_worker,
+                                 initargs=(logging.getLogger().level,)) as executor:
+            results.append(executor.submit(_benchmark_backend, config_file, backend, max_steps, profile,
+                                           **settings).result())
+    print(f"{'backend':10} {'steps':>7} {'seconds':>9} {'steps/s':>9} {'vehicles/s':>11} {'round trips':>12}")
+    for backend, steps, elapsed, vehicle_steps, calls in results:
+        print(f"{backend:10} {steps:7d} {elapsed:9.2f} {steps / elapsed:9.1f} {vehicle_steps / elapsed:11.0f} "
+              f"{'n/a' if calls is None else calls:>12}")
+    return results
+
+
+def main(config_file='osm.sumocfg', backend='sumo-gui', tracked_vehicle='veh0', profile=False, trace_file=None,
+         metrics_file=None, metrics_batch=1000, **settings):
+    metrics = MetricsSink(metrics_file, metrics_batch) if metrics_file else None
+    controller, round_trips = start_controller(config_file, backend, metrics=metrics, **settings)
+    highlight_vehicle(tracked_vehicle)
+
+    profiler = Profiler(trace_file) if profile or trace_file else None
+    if profiler is not None:
+        profiler.install()
+    try:
+        round_trips.steps = run(controller, profiler=profiler)[0]
+    finally:
+        # also when the connection is lost (e.g. the GUI was closed), so that no buffered records are lost
+        controller.finish()
+        if metrics is not None:
+            metrics.close()
+        if profiler is not None:
+            profiler.close()
+    if metrics is not None:
+        print(f"Vehicle metrics: {metrics.records} records in {metrics_file}")
+    if profiler is not None:
+        print(profiler.summary())
+
+    print(round_trips.summary())
+    if controller.routes is not None:
+        print(f"Routes from the table: {controller.table_routes}, searched by SUMO: {controller.searched_routes}")
+    close_simulation()
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Parking search controller for a SUMO scenario')
+    parser.add_argument('-c', '--config', default='osm.sumocfg', help='SUMO configuration of the scenario')
+    parser.add_argument('-b', '--backend', choices=BACKENDS, default='sumo-gui',
+                        help='sumo or sumo-gui over a TraCI socket, or libsumo inside this process')
+    parser.add_argument('-t', '--track', default='veh0', help='vehicle to highlight in the GUI')
+    parser.add_argument('-k', '--candidates', type=int, default=1,
+                        help='choose the parking area with the most free spaces among this many nearest ones '
+                             'with a free space (default: the nearest one)')
+    parser.add_argument('--route-table', action='store_true',
+                        help='set the routes from the rerouter and parking area edges to the parking areas from a '
+                             'table searched once per network instead of letting SUMO search them')
+    parser.add_argument('--refresh-interval', type=int, default=300,
+                        help='steps between the comparisons of the route table with the current travel times')
+    parser.add_argument('--refresh-threshold', type=float, default=0.2,
+                        help='relative change of a route cost which makes the routes of its edge be searched again')
+    parser.add_argument('--net-cache', type=str,
+                        help='directory of the binary net cache (default: .netcache next to the net)')
+    parser.add_argument('--profile', action='store_true',
+                        help='time the TraCI calls and the controller and print a summary at the end')
+    parser.add_argument('--trace', type=str,
+                        help='write the calls and times of every simulation step as CSV file (implies --profile)')
+    parser.add_argument('--benchmark', type=str,
+                        help='comma-separated backends to compare in throughput instead of running the scenario '
+                             '(e.g. sumo,libsumo)')
+    parser.add_argument('--steps', type=int, default=1000, help='simulation steps per backend of the benchmark')
+    parser.add_argument('--metrics', type=str, default='output/vehicle_metrics.csv',
+                        help='CSV file of the per-vehicle search metrics, empty to disable')
+    parser.add_argument('--metrics-batch', type=int, default=1000,
+                        help='number of vehicle records buffered before they are written')
+    parser.add_argument('--log-level', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'), default='WARNING',
+                        help='INFO reports vehicles leaving before parking, DEBUG every departure and parked vehicle')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format='%(message)s')
+    settings = dict(candidates=args.candidates, route_table=args.route_table, refresh_interval=args.refresh_interval,
+                    threshold=args.refresh_threshold, net_cache=args.net_cache)
+    if args.benchmark:
+        backends = args.benchmark.split(',')
+        unknown = [backend for backend in backends if backend not in BACKENDS]
+        if unknown:
+            parser.error('unknown backends: %s' % ', '.join(unknown))
+        benchmark(args.config, backends, args.steps, args.profile, **settings)
+    else:
+        main(args.config, args.backend, args.track, args.profile, args.trace, args.metrics, args.metrics_batch,
+             **settings)